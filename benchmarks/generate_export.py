@@ -0,0 +1,266 @@
+"""
+Generates synthetic Notion exports (zip files), with the structure and markup of real ones:
+headings, paragraphs, lists, callouts (some of them "Internal"), database property tables, a TOC, images and sub-pages
+
+Usage: python benchmarks/generate_export.py export.zip [--headings 30] [--images 5] [--pages 3] ...
+"""
+
+import argparse
+import html
+import random
+import uuid
+import zipfile
+from urllib.parse import quote
+
+import fitz  # PyMuPDF
+
+WORDS = (
+    "project team customer release roadmap quality design review budget milestone scope risk "
+    "delivery feature platform process update meeting decision owner target metric result plan "
+    "the a of to and in for with on is will be our this that we each by from"
+).split()
+
+# Notion inlines a large stylesheet in each exported page
+NOTION_CSS = "\n".join(
+    f".block-color-{color} {{ color: rgba({i * 20}, 100, 100, 1); fill: rgba({i * 20}, 100, 100, 1); }}\n"
+    f".block-color-{color}_background {{ background: rgba({i * 20}, 100, 100, 0.2); }}\n"
+    f".highlight-{color} {{ color: rgba({i * 20}, 100, 100, 1); }}"
+    for i, color in enumerate(
+        ["gray", "brown", "orange", "yellow", "teal", "blue", "purple", "pink", "red"]
+    )
+) + """
+html { -webkit-print-color-adjust: exact; }
+* { box-sizing: border-box; -webkit-print-color-adjust: exact; }
+html, body { margin: 0; padding: 0; }
+body { line-height: 1.5; white-space: pre-wrap; }
+.page-title { font-size: 2.5rem; font-weight: 700; margin-top: 0; margin-bottom: 0.75em; }
+.page-description { margin-bottom: 2em; }
+table, th, td { border: 1px solid rgba(55, 53, 47, 0.09); border-collapse: collapse; }
+.callout { border-radius: 3px; padding: 1rem; }
+figure { margin: 1.25em 0; page-break-inside: avoid; }
+img { max-width: 100%; }
+.table_of_contents-item { display: block; font-size: 0.875rem; line-height: 1.3; padding: 0.125rem; }
+.table_of_contents-indent-1 { margin-left: 1.5rem; }
+.table_of_contents-indent-2 { margin-left: 3rem; }
+.table_of_contents-link { text-decoration: none; opacity: 0.7; }
+"""
+
+# Levels of the headings, in turn
+HEADING_LEVELS = [1, 1, 2, 2, 2, 3, 3]
+
+
+class ExportGenerator:
+    """
+    headings: number of headings (h1 to h3) of each page
+    paragraphs: number of paragraphs of each page (spread between the headings)
+    callouts: number of callouts of each page, `internal_callouts` of them being "Internal" ones
+    properties: number of database properties in the header of each page
+    databases: number of inline database tables of each page
+    images: number of images of each page
+    pages: total number of pages (the first one, and its sub-pages)
+    """
+
+    def __init__(
+        self,
+        headings=30,
+        paragraphs=150,
+        callouts=10,
+        internal_callouts=3,
+        properties=6,
+        databases=1,
+        toc=True,
+        images=5,
+        image_size=(1600, 1000),
+        pages=1,
+        seed=0,
+    ):
+        self.headings = headings
+        self.paragraphs = paragraphs
+        self.callouts = callouts
+        self.internal_callouts = min(internal_callouts, callouts)
+        self.properties = properties
+        self.databases = databases
+        self.toc = toc
+        self.images = images
+        self.image_size = image_size
+        self.pages = pages
+        self.random = random.Random(seed)
+
+    def make_id(self):
+        return str(uuid.UUID(int=self.random.getrandbits(128)))
+
+    def make_text(self, words):
+        text = " ".join(self.random.choice(WORDS) for _ in range(words))
+        return text[0].upper() + text[1:] + "."
+
+    def make_image(self, photo):
+        """
+        A JPEG photo (blurred noise), or a PNG screenshot (flat boxes and text),
+        which compress about as well as real ones
+        """
+        width, height = self.image_size
+        if photo:
+            noise = bytes(self.random.getrandbits(8) for _ in range(40 * 25 * 3))
+            pix = fitz.Pixmap(fitz.Pixmap(fitz.csRGB, 40, 25, noise, False), width, height)
+            return pix.tobytes("jpeg", jpg_quality=90), "jpg"
+
+        doc = fitz.open()
+        page = doc.new_page(width=width, height=height)
+        for _ in range(12):
+            x, y = self.random.uniform(0, width * 0.8), self.random.uniform(0, height * 0.8)
+            size = (self.random.uniform(50, width / 3), self.random.uniform(20, height / 4))
+            rect = fitz.Rect(x, y, x + size[0], y + size[1])
+            page.draw_rect(rect, fill=[self.random.random() for _ in range(3)], color=None)
+            page.insert_text(rect.tl + (8, 24), self.make_text(5), fontsize=16)
+        return page.get_pixmap().tobytes("png"), "png"
+
+    def generate(self, output_zip):
+        """Writes the export to `output_zip`"""
+        with zipfile.ZipFile(output_zip, "w", zipfile.ZIP_DEFLATED) as zip_file:
+            root_title = self.make_text(3).rstrip(".")
+            root_name = f"{root_title} {self.make_id().replace('-', '')}"
+            sub_pages = [
+                (self.make_text(3).rstrip("."), self.make_id().replace("-", ""))
+                for _ in range(self.pages - 1)
+            ]
+
+            self.write_page(zip_file, root_title, root_name, sub_pages)
+            for title, page_id in sub_pages:
+                self.write_page(zip_file, title, f"{root_name}/{title} {page_id}", [])
+
+    def write_page(self, zip_file, title, name, sub_pages):
+        """Writes `name`.html, with its images (and sub-pages) in the `name` folder"""
+        folder = name.rsplit("/", 1)[-1]
+        blocks = []
+
+        heading_blocks = []
+        for i in range(self.headings):
+            level = HEADING_LEVELS[i % len(HEADING_LEVELS)] if i else 1
+            heading_id = self.make_id()
+            heading_blocks.append((level, heading_id, self.make_text(4).rstrip(".")))
+
+        # Every kind of block is spread evenly over the page
+        items = [("heading", block) for block in heading_blocks]
+        items += [("paragraph", None)] * self.paragraphs
+        items += [("callout", i < self.internal_callouts) for i in range(self.callouts)]
+        items += [("database", None)] * self.databases
+        items += [("image", i % 2 == 0) for i in range(self.images)]
+        items += [("list", None)] * (self.paragraphs // 10)
+        headings = items[: len(heading_blocks)]
+        others = items[len(heading_blocks) :]
+        self.random.shuffle(others)
+        step = len(others) / max(1, len(headings))
+        ordered = []
+        for i, heading in enumerate(headings):
+            ordered.append(heading)
+            ordered += others[round(i * step) : round((i + 1) * step)]
+        if not headings:
+            ordered = others
+
+        if self.toc:
+            blocks.append(self.make_toc(heading_blocks))
+
+        image_index = 0
+        for kind, value in ordered:
+            block_id = self.make_id()
+            if kind == "heading":
+                level, heading_id, text = value
+                blocks.append(f'<h{level} id="{heading_id}" class="">{html.escape(text)}</h{level}>')
+            elif kind == "paragraph":
+                blocks.append(f'<p id="{block_id}" class="">{self.make_text(self.random.randint(10, 60))}</p>')
+            elif kind == "list":
+                items_html = "".join(
+                    f'<ul id="{self.make_id()}" class="bulleted-list"><li style="list-style-type:disc">'
+                    f"{self.make_text(8)}</li></ul>"
+                    for _ in range(self.random.randint(2, 5))
+                )
+                blocks.append(items_html)
+            elif kind == "callout":
+                text = ("Internal: " if value else "") + self.make_text(20)
+                blocks.append(
+                    f'<figure class="block-color-gray_background callout" style="white-space:pre-wrap;display:flex" '
+                    f'id="{block_id}"><div style="font-size:1.5em"><span class="icon">💡</span></div>'
+                    f'<div style="width:100%">{text}</div></figure>'
+                )
+            elif kind == "database":
+                blocks.append(self.make_database(block_id))
+            elif kind == "image":
+                data, extension = self.make_image(photo=value)
+                image_index += 1
+                image_name = f"Untitled {image_index}.{extension}"
+                zip_file.writestr(f"{name}/{image_name}", data)
+                src = quote(f"{folder}/{image_name}")
+                blocks.append(
+                    f'<figure id="{block_id}" class="image"><a href="{src}">'
+                    f'<img style="width:{self.random.choice([240, 480, 720, 1200])}px" src="{src}"/></a></figure>'
+                )
+
+        for sub_title, sub_id in sub_pages:
+            href = quote(f"{folder}/{sub_title} {sub_id}.html")
+            blocks.append(
+                f'<figure id="{self.make_id()}" class="link-to-page"><a href="{href}">'
+                f'<span class="icon">📄</span>{html.escape(sub_title)}</a></figure>'
+            )
+
+        properties = "".join(
+            f'<tr class="property-row property-row-text"><th>Property {i + 1}</th>'
+            f"<td>{self.make_text(3)}</td></tr>"
+            for i in range(self.properties)
+        )
+        page_html = (
+            f'<html><head><meta http-equiv="Content-Type" content="text/html; charset=utf-8"/>'
+            f"<title>{html.escape(title)}</title><style>{NOTION_CSS}</style></head><body>"
+            f'<article id="{self.make_id()}" class="page sans"><header>'
+            f'<h1 class="page-title">{html.escape(title)}</h1>'
+            f'<p class="page-description">{self.make_text(12)}</p>'
+            f'<table class="properties"><tbody>{properties}</tbody></table></header>'
+            f'<div class="page-body">{"".join(blocks)}</div></article>'
+            f'<span class="sans" style="font-size:14px;padding-top:2em"></span></body></html>'
+        )
+        zip_file.writestr(f"{name}.html", page_html)
+
+    def make_toc(self, heading_blocks):
+        items = "".join(
+            f'<div class="table_of_contents-item table_of_contents-indent-{level - 1}">'
+            f'<a class="table_of_contents-link" href="#{heading_id}">{html.escape(text)}</a></div>'
+            for level, heading_id, text in heading_blocks
+        )
+        return f'<nav id="{self.make_id()}" class="block-color-gray table_of_contents">{items}</nav>'
+
+    def make_database(self, block_id):
+        columns = ["Name", "Status", "Owner", "Due date"]
+        header = "".join(f"<th>{column}</th>" for column in columns)
+        rows = "".join(
+            "<tr>" + "".join(f"<td>{self.make_text(2)}</td>" for _ in columns) + "</tr>"
+            for _ in range(self.random.randint(3, 10))
+        )
+        return (
+            f'<div id="{block_id}" class="collection-content"><h4 class="collection-title">'
+            f"{self.make_text(2)}</h4><table class=\"collection-content\"><thead><tr>{header}</tr></thead>"
+            f"<tbody>{rows}</tbody></table></div>"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("output_zip")
+    parser.add_argument("--headings", type=int, default=30)
+    parser.add_argument("--paragraphs", type=int, default=150)
+    parser.add_argument("--callouts", type=int, default=10)
+    parser.add_argument("--internal-callouts", type=int, default=3)
+    parser.add_argument("--properties", type=int, default=6)
+    parser.add_argument("--databases", type=int, default=1)
+    parser.add_argument("--toc", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--images", type=int, default=5)
+    parser.add_argument("--pages", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    options = vars(args)
+    output_zip = options.pop("output_zip")
+    ExportGenerator(**options).generate(output_zip)
+    print(f"Export generated at {output_zip}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Checks the cold start of the CLI: commands that convert nothing (--help, --version, invalid arguments)
+must not import the heavy modules of the conversion, and must start within a time budget
+
+Usage: python benchmarks/import_time.py [--budget 150] [--repeat 5]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+# Only needed once a conversion starts
+HEAVY_MODULES = ["fitz", "playwright", "bs4", "jinja2", "lxml", "PIL"]
+
+COMMANDS = [
+    ["--help"],
+    ["--version"],
+    ["export.zip", "-t", "example", "--title"],
+]
+
+
+def get_imported_modules(command):
+    """The top-level modules imported by the command, from Python's -X importtime output"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "notion_export_prettify.main", *command],
+        capture_output=True,
+        text=True,
+    )
+    modules = set()
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            name = line.rsplit("|", 1)[1].strip()
+            modules.add(name.split(".")[0])
+    return modules
+
+
+def time_command(argv, repeat):
+    """Median wall time of the command, in ms"""
+    times = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        subprocess.run(argv, capture_output=True)
+        times.append((time.perf_counter() - started_at) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=150,
+        help="Maximum time of each command (in ms), including the start of the interpreter",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # Time of the interpreter alone, for reference
+    baseline = time_command([sys.executable, "-c", "pass"], args.repeat)
+    print(f"{'python -c pass':<40}{baseline:>10.1f} ms")
+
+    failed = False
+    for command in COMMANDS:
+        label = " ".join(command)
+        heavy = sorted(set(HEAVY_MODULES) & get_imported_modules(command))
+        wall = time_command(
+            [sys.executable, "-m", "notion_export_prettify.main", *command], args.repeat
+        )
+        over_budget = wall > args.budget
+        failed = failed or over_budget or bool(heavy)
+        print(
+            f"{label:<40}{wall:>10.1f} ms"
+            f"{'  OVER BUDGET' if over_budget else ''}"
+            f"{'  IMPORTS ' + ', '.join(heavy) if heavy else ''}"
+        )
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Compares the HTML parser backends on Notion exports:
+- parse and serialise time of each backend
+- conformance: all manipulations must produce the same HTML as with html.parser
+
+Usage: python benchmarks/parsers.py export.html [export2.html ...] [--repeat 5]
+"""
+
+import argparse
+import sys
+import time
+
+from notion_export_prettify.html_parser import available_parsers, parse_html
+from notion_export_prettify.notion_html_manipulator import NotionHtmlManipulator
+
+REFERENCE_PARSER = "html.parser"
+
+
+def best_time(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started_at)
+    return min(timings), result
+
+
+def manipulate(html_file, parser):
+    """Runs all manipulations, the same way the converter does"""
+    manipulator = NotionHtmlManipulator(html_file, parser=parser)
+    manipulator.add_css_overwrites("body { color: black; }")
+    manipulator.apply(
+        [
+            manipulator.internal_info_rule(),
+            manipulator.database_properties_rule(),
+            manipulator.heading_numbers_rule(),
+            manipulator.toc_rule(keep=True),
+            manipulator.title_block_rule("<div class='header'>Title</div>"),
+            manipulator.heading_map_rule(),
+        ]
+    )
+    return manipulator.get_html(), manipulator.get_heading_map()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("html_files", nargs="+")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    conform = True
+    for html_file in args.html_files:
+        with open(html_file, "r") as f:
+            content = f.read()
+        print(f"{html_file} ({len(content) / 1024:.0f} KB)")
+        print(f"  {'parser':<14}{'parse (ms)':>12}{'serialise (ms)':>16}  conformance")
+
+        reference = manipulate(html_file, REFERENCE_PARSER)
+        for backend in available_parsers():
+            parse_time, soup = best_time(lambda: parse_html(content, backend), args.repeat)
+            serialise_time, _ = best_time(lambda: str(soup), args.repeat)
+
+            same = manipulate(html_file, backend) == reference
+            conform = conform and same
+            print(
+                f"  {backend:<14}{parse_time * 1000:>12.1f}{serialise_time * 1000:>16.1f}"
+                f"  {'same output' if same else 'DIFFERENT OUTPUT'}"
+            )
+
+    sys.exit(0 if conform else 1)
+
+
+if __name__ == "__main__":
+    main()
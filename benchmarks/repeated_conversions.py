@@ -0,0 +1,68 @@
+"""
+Checks conversions following each other in one thread, with one browser session (as with --watch, the render
+server or the API): regular, chunked (--render-chunks) and concurrent (--concurrent) conversions must all
+succeed in any order, give the same pages, and reuse the browsers started by the first ones
+
+Usage: python benchmarks/repeated_conversions.py [--template example] [--chunks 4]
+"""
+
+import argparse
+import sys
+import tempfile
+from os import path
+
+import fitz  # PyMuPDF
+from generate_export import ExportGenerator
+
+from notion_export_prettify.api import convert
+from notion_export_prettify.browser_session import BrowserSession
+from notion_export_prettify.exceptions import ConversionError
+
+# One sync browser for the regular renders, and one async browser for the others
+MAX_LAUNCHES = 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--template", default="example")
+    parser.add_argument("--chunks", type=int, default=4)
+    args = parser.parse_args()
+
+    conversions = [
+        ("regular", {}),
+        ("chunked", {"render-chunks": args.chunks}),
+        ("chunked", {"render-chunks": args.chunks}),
+        ("concurrent", {"concurrent": True}),
+        ("concurrent", {"concurrent": True}),
+        ("regular", {}),
+    ]
+
+    failed = False
+    launches = 0
+    page_counts = set()
+    with tempfile.TemporaryDirectory() as temp_dir, BrowserSession() as session:
+        export = path.join(temp_dir, "export.zip")
+        ExportGenerator(headings=40, paragraphs=200).generate(export)
+
+        for label, options in conversions:
+            try:
+                result = convert(export, template=args.template, options=options, session=session)
+            except ConversionError as e:
+                failed = True
+                print(f"{label:<16}FAILED  {type(e).__name__}: {e}")
+                continue
+            pages = len(fitz.open(stream=result.pdf, filetype="pdf"))
+            page_counts.add(pages)
+            launches += result.profile["counters"].get("browser_launches", 0)
+            print(f"{label:<16}{result.seconds * 1000:>10.1f} ms{pages:>6} pages")
+
+    if len(page_counts) > 1:
+        failed = True
+        print(f"Page counts differ: {sorted(page_counts)}")
+    print(f"Browser launches: {launches}{'  TOO MANY' if launches > MAX_LAUNCHES else ''}")
+    if failed or launches > MAX_LAUNCHES:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Compares the save profiles on existing PDFs (eg. documents generated with the 'fast' profile):
+size and save time of each profile
+
+Usage: python benchmarks/save_profiles.py document.pdf [document2.pdf ...]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from os import path
+
+import fitz  # PyMuPDF
+
+from notion_export_prettify.pdf_maker import SAVE_PROFILES, PdfMaker
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("pdf_files", nargs="+")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for pdf_file in args.pdf_files:
+            original_size = os.path.getsize(pdf_file)
+            print(f"{pdf_file} ({original_size / 1024:.0f} KB)")
+            print(f"  {'profile':<10}{'size (KB)':>12}{'ratio':>8}{'save (s)':>10}")
+
+            for profile in SAVE_PROFILES:
+                pdf_maker = PdfMaker(temp_dir)
+                pdf_maker.pdf_doc = fitz.open(pdf_file)
+
+                started_at = time.perf_counter()
+                size = pdf_maker.save(path.join(temp_dir, f"{profile}.pdf"), profile)
+                duration = time.perf_counter() - started_at
+                print(
+                    f"  {profile:<10}{size / 1024:>12.0f}"
+                    f"{size / original_size:>8.0%}{duration:>10.2f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Times each stage of the pipeline, and the whole conversion, on synthetic exports with the built-in templates.
+Results are saved per version (in benchmarks/results), to be compared with those of another version.
+
+Usage: python benchmarks/stages.py [--sizes small medium] [--repeat 3] [--html-only]
+                                   [--compare benchmarks/results/0.2.0-full.json]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from importlib.metadata import version
+from os import path
+
+from generate_export import ExportGenerator
+
+from notion_export_prettify.args import parse_args
+from notion_export_prettify.converter import Converter
+from notion_export_prettify.profiler import profile, stage
+
+RESULTS_DIR = path.join(path.dirname(__file__), "results")
+
+TEMPLATES = ["example", "example-landscape"]
+
+# Exports of increasing size
+SIZES = {
+    "small": dict(headings=10, paragraphs=40, callouts=3, internal_callouts=1, images=2),
+    "medium": dict(
+        headings=40, paragraphs=200, callouts=12, internal_callouts=4, images=8, databases=2
+    ),
+    "large": dict(
+        headings=150, paragraphs=1000, callouts=40, internal_callouts=10, images=30, databases=5
+    ),
+}
+
+
+def run_once(export, template, html_only, temp_dir):
+    """Converts the export, and returns the profile of the conversion"""
+    args = parse_args(
+        [export, "-t", template, "--output", path.join(temp_dir, "output.pdf")]
+    )
+    with profile() as profiler, contextlib.redirect_stdout(io.StringIO()):
+        converter = Converter(args)
+        if html_only:
+            # Only the stages that don't need a browser
+            with stage("convert"), tempfile.TemporaryDirectory() as extract_dir:
+                converter.manipulate_html(converter.extract_input(extract_dir))
+        else:
+            converter.run()
+    return profiler.get_report()
+
+
+def summarise(reports):
+    """Median time of each stage (summed over its calls in a conversion), and of the whole conversion"""
+    stages = {}
+    for report in reports:
+        totals = {}
+        for record in report["stages"]:
+            totals[record["name"]] = totals.get(record["name"], 0) + record["wall"]
+        for name, wall in totals.items():
+            stages.setdefault(name, []).append(wall)
+    return dict(
+        total=statistics.median(report["wall"] for report in reports),
+        peak_rss_mb=max(report["peak_rss_mb"] or 0 for report in reports),
+        stages={name: statistics.median(walls) for name, walls in stages.items()},
+    )
+
+
+def compare(results, previous, threshold):
+    """Prints the ratio of each time to the previous one, and returns whether any exceeds the threshold"""
+    regressed = False
+    print(f"\nCompared with {previous['version']} ({previous['date']})")
+    for key, result in results.items():
+        if key not in previous["results"]:
+            continue
+        old = previous["results"][key]
+        timings = [("total", result["total"], old["total"])]
+        timings += [
+            (name, wall, old["stages"][name])
+            for name, wall in result["stages"].items()
+            if name in old["stages"]
+        ]
+        print(f"  {key}")
+        for name, new_time, old_time in timings:
+            ratio = new_time / old_time if old_time else 1
+            # Ignore the noise of very short stages
+            slower = ratio > threshold and new_time - old_time > 0.005
+            regressed = regressed or slower
+            print(
+                f"    {name:<22}{old_time * 1000:>10.1f}{new_time * 1000:>10.1f} ms"
+                f"{ratio:>8.2f}x{'  REGRESSION' if slower else ''}"
+            )
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--templates", nargs="+", default=TEMPLATES)
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=list(SIZES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--html-only",
+        action="store_true",
+        help="Only time the stages that don't need a browser (extraction, parsing, manipulations)",
+    )
+    parser.add_argument("--output", help="Where to save the results. Defaults to benchmarks/results")
+    parser.add_argument("--compare", help="Results of a previous version, to compare with")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.2,
+        help="With --compare, ratio to the previous time past which a stage is reported as a regression",
+    )
+    args = parser.parse_args()
+
+    mode = "html" if args.html_only else "full"
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size in args.sizes:
+            export = path.join(temp_dir, f"{size}.zip")
+            ExportGenerator(**SIZES[size]).generate(export)
+
+            for template in args.templates:
+                key = f"{template}/{size}"
+                # The first run starts the browser and warms up the caches
+                run_once(export, template, args.html_only, temp_dir)
+                reports = [
+                    run_once(export, template, args.html_only, temp_dir)
+                    for _ in range(args.repeat)
+                ]
+                results[key] = summarise(reports)
+
+                print(f"{key}: {results[key]['total'] * 1000:.1f} ms")
+                for name, wall in results[key]["stages"].items():
+                    print(f"  {name:<24}{wall * 1000:>10.1f} ms")
+
+    report = dict(
+        version=version("notion-export-prettify"),
+        date=time.strftime("%Y-%m-%d %H:%M:%S"),
+        mode=mode,
+        repeat=args.repeat,
+        python=platform.python_version(),
+        platform=platform.platform(),
+        cpus=os.cpu_count(),
+        results=results,
+    )
+    output = args.output or path.join(RESULTS_DIR, f"{report['version']}-{mode}.json")
+    os.makedirs(path.dirname(path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if compare(results, previous, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Conversions in the current process, without going through the command line.
+
+    from notion_export_prettify.api import convert
+
+    result = convert("export.zip", template="example", metadata=dict(author="Me"))
+    result.save("document.pdf")
+
+Conversions are thread-safe: each thread renders with its own browser (Playwright's sync API is bound to a thread),
+started on first use and kept for the next conversions of that thread.
+"""
+
+import shutil
+import tempfile
+import zipfile
+from contextlib import nullcontext
+from os import PathLike, fspath, path
+
+from .args import modify_config_path, options_to_argv, parse_args
+from .browser_session import BrowserSession, playwright_error
+from .converter import Converter
+from .exceptions import (
+    ConversionError,
+    InvalidExportError,
+    InvalidOptionsError,
+    RenderError,
+    TemplateNotFoundError,
+)
+from .print_color import quiet as quiet_output
+from .profiler import profile
+from .resource_loader import TemplateCache
+
+# Options of the command line that don't apply to a conversion returning a single document
+CLI_ONLY_OPTIONS = [
+    "output",
+    "watch",
+    "workspace",
+    "merge",
+    "jobs",
+    "profile-report",
+    "profile-trace",
+    "log-level",
+    "previews",
+]
+
+
+class ConversionResult:
+    """
+    pdf: the PDF document
+    metadata: the metadata injected into the templates (title, author...)
+    profile: wall time, CPU time and memory of each stage, with counters (see `profiler.Profiler.get_report`)
+    thumbnails: with `previews`, a PNG image of each of the first pages
+    strip: with `previews`, a PNG image of the first pages side by side, in perspective
+    resources: the remote resources blocked, failed and slow to load (see `ResourcePolicy.get_report`)
+    """
+
+    def __init__(
+        self,
+        pdf: bytes,
+        metadata: dict,
+        profile: dict,
+        thumbnails: list = None,
+        strip: bytes = None,
+        resources: dict = None,
+    ):
+        self.pdf = pdf
+        self.metadata = metadata
+        self.profile = profile
+        self.thumbnails = thumbnails
+        self.strip = strip
+        self.resources = resources
+
+    @property
+    def seconds(self):
+        return self.profile["wall"]
+
+    def save(self, output_file):
+        with open(output_file, "wb") as f:
+            f.write(self.pdf)
+
+
+def convert(
+    export,
+    template: str = None,
+    options: dict = None,
+    metadata: dict = None,
+    session: BrowserSession = None,
+    templates: TemplateCache = None,
+    quiet=True,
+    previews=False,
+) -> ConversionResult:
+    """
+    Converts a Notion export, and returns the PDF document with its metadata and timings.
+
+    export: path to the zip or HTML file, or the zip file as bytes or a binary stream
+    template: name of a built-in template, or path to a template folder or config file
+    options: options of the command line by name (eg. `{"cover-page": False, "save-profile": "compact"}`)
+    metadata: metadata by name (eg. `{"title": "My title", "author": "Me"}`)
+    session: the browser to render with, which must belong to the calling thread.
+        Defaults to the one shared by the conversions of the calling thread.
+        With the "concurrent" option, renders use the async browser of the session, on its loop thread
+        (see BrowserSession.run_async)
+    templates: where to reuse templates from, to only read each of them once
+    quiet: don't print the progress of the conversion
+    previews: also render the thumbnails and strip of the first pages
+        (set by the "preview-pages", "preview-dpi" and "preview-size" options)
+
+    Raises a ConversionError: InvalidOptionsError, TemplateNotFoundError, InvalidExportError or RenderError
+    """
+    options = {key.replace("_", "-"): value for key, value in (options or {}).items()}
+    if cli_options := [key for key in options if key in CLI_ONLY_OPTIONS or key == "template"]:
+        raise InvalidOptionsError(f"Options not supported by the API: {', '.join(cli_options)}")
+
+    if template:
+        template = modify_config_path(["-t", fspath(template)])[1]
+        if not path.isfile(template):
+            raise TemplateNotFoundError(f"Template not found: {template}")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_file = get_input_file(export, temp_dir)
+        argv = [input_file] + options_to_argv(
+            [("template", template)] + list(options.items()) + list((metadata or {}).items())
+        )
+        args = parse_args(argv, raise_errors=True)
+        resources = templates.get_resources(args.template) if templates is not None else None
+
+        output_file = path.join(temp_dir, "output.pdf")
+        with profile() as profiler, (quiet_output() if quiet else nullcontext()):
+            converter = Converter(
+                args, session=session, resources=resources, keep_previews=previews
+            )
+            convert_document(converter, output_file)
+
+        with open(output_file, "rb") as f:
+            pdf = f.read()
+    return ConversionResult(
+        pdf,
+        converter.metadata,
+        profiler.get_report(),
+        converter.thumbnails,
+        converter.strip,
+        converter.resource_policy.get_report(),
+    )
+
+
+def get_input_file(export, temp_dir):
+    """The path of the export, written to the temporary directory if given as bytes or a stream"""
+    if isinstance(export, (str, PathLike)):
+        input_file = fspath(export)
+        if not path.exists(input_file):
+            raise InvalidExportError(f"No such file: {input_file}")
+        return input_file
+
+    input_file = path.join(temp_dir, "export.zip")
+    with open(input_file, "wb") as f:
+        if isinstance(export, (bytes, bytearray, memoryview)):
+            f.write(export)
+        elif hasattr(export, "read"):
+            shutil.copyfileobj(export, f)
+        else:
+            raise InvalidExportError(f"Unsupported export type: {type(export).__name__}")
+
+    if not zipfile.is_zipfile(input_file):
+        raise InvalidExportError("Exports given as bytes or streams must be zip files")
+    return input_file
+
+
+def convert_document(converter: Converter, output_file=None):
+    """
+    Runs the conversion (with the concurrent pipeline if enabled), and returns the path of the PDF file generated.
+    Browser errors are raised as RenderError
+    """
+    try:
+        if converter.args.concurrent:
+            from .pipeline import convert as convert_concurrently
+
+            return convert_concurrently(converter, output_file)
+        return converter.run(output_file)
+    except ConversionError:
+        raise
+    except playwright_error() as e:
+        raise RenderError(str(e)) from e
+
+
+def run(args, session: BrowserSession = None):
+    """Runs the conversion described by the parsed command line `args` (see `main`)"""
+    if args.workspace:
+        from .workspace import convert_workspace
+
+        return convert_workspace(args)
+    return convert_document(Converter(args, session=session))
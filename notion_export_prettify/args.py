@@ -1,11 +1,12 @@
 import argparse
 import logging
 import sys
-from importlib.metadata import version
 from os import getcwd, path
 
 import configargparse
 
+from .exceptions import InvalidOptionsError
+
 
 # Function to manually find and modify the --config argument to make it a full path
 def modify_config_path(args):
@@ -58,11 +59,86 @@ def modify_config_path(args):
     return args
 
 
-def parse_args():
+class VersionAction(argparse.Action):
+    """Like argparse's "version" action, but only looks the version up when asked for it"""
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS, help=None):
+        super().__init__(option_strings, dest=dest, default=default, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        from importlib.metadata import version
+
+        parser.exit(message=version("notion-export-prettify") + "\n")
+
+
+class RaisingArgumentParser(configargparse.ArgumentParser):
+    """Raises InvalidOptionsError on invalid arguments, instead of printing the usage and exiting"""
+
+    def error(self, message):
+        raise InvalidOptionsError(message)
+
+
+# Options that can be turned on and off, with `--option` / `--no-option`
+BOOLEAN_OPTIONS = [
+    "cover-page",
+    "heading-numbers",
+    "strip-internal-info",
+    "table-of-contents",
+    "in-memory",
+    "concurrent",
+    "lazy-assets",
+    "optimize-images",
+    "render-cache",
+]
+TRUE_VALUES = ["1", "true", "yes", "on"]
+FALSE_VALUES = ["0", "false", "no", "off"]
+
+
+def to_boolean(key, value):
+    """The value of a boolean option, given as a boolean, a number or a string (eg. "true", "no")"""
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise InvalidOptionsError(f"Invalid value for {key}: {value!r} (expected a boolean)")
+
+
+def options_to_argv(options):
+    """
+    Turns (name, value) pairs of options and metadata into command line arguments.
+    Boolean options can be given as booleans, numbers or strings (eg. "true", "no").
+    Raises InvalidOptionsError for other values of boolean options
+    """
+    argv = []
+    for key, value in options:
+        if value is None or value == "":
+            continue
+        if key == "template":
+            argv += ["-t", str(value)]
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                argv += [f"--{key}", str(item)]
+        elif key in BOOLEAN_OPTIONS:
+            argv.append(("--" if to_boolean(key, value) else "--no-") + key)
+        else:
+            argv += [f"--{key}", str(value)]
+    return argv
+
+
+def parse_args(args=None, raise_errors=False):
+    """
+    raise_errors: raise InvalidOptionsError on invalid arguments, instead of printing the usage and exiting
+    """
     # Preprocess the command line arguments
-    sanitized_args = modify_config_path(sys.argv[1:])
+    if args is None:
+        args = sys.argv[1:]
+    sanitized_args = modify_config_path(list(args))
 
-    parser = configargparse.ArgumentParser(
+    parser_class = RaisingArgumentParser if raise_errors else configargparse.ArgumentParser
+    parser = parser_class(
         description="Turn a Notion page into a styled PDF document."
     )
 
@@ -90,7 +166,23 @@ def parse_args():
     )
 
     parser.add_argument(
-        "-v", "--version", action="version", version=version("notion-export-prettify")
+        "-w",
+        "--watch",
+        action="store_true",
+        help="Keep running, and regenerate the PDF whenever the input file or the template change. "
+        "Only the stages affected by a change are redone",
+    )
+
+    parser.add_argument(
+        "-v", "--version", action=VersionAction, help="show program's version number and exit"
+    )
+
+    parser.add_argument(
+        "--log-level",
+        type=str.upper,
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        default="WARNING",
+        help="Level of the log messages to show",
     )
 
     # metadata
@@ -135,5 +227,198 @@ def parse_args():
         default=True,
         help="Add a table of contents (if existing in the Notion document)",
     )
+    options.add_argument(
+        "--in-memory",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Pass documents between stages in memory, instead of through temporary files",
+    )
+    options.add_argument(
+        "--concurrent",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Run independent stages concurrently: the cover is rendered while the main document is, "
+        "and PDF merges run alongside the renders (single conversions only)",
+    )
+    options.add_argument(
+        "--render-chunks",
+        type=int,
+        default=1,
+        help="Split the main document at its top-level h1 headings into up to this many chunks, "
+        "rendered concurrently and stitched together. For very large documents, with templates that "
+        "start each h1 heading on a new page",
+    )
+    options.add_argument(
+        "--lazy-assets",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Only read the resources that the document needs from the zip file, instead of extracting all of it. "
+        "With --in-memory, they are served straight from the zip file",
+    )
+    options.add_argument(
+        "--html-parser",
+        choices=["auto", "lxml", "html5-parser", "html.parser"],
+        default="auto",
+        help="HTML parser to use. 'auto' picks the fastest one installed (lxml, then html5-parser), "
+        "and falls back to Python's built-in html.parser",
+    )
+    options.add_argument(
+        "--optimize-images",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Downsample images to the resolution they are printed at. "
+        "Results are cached between runs",
+    )
+    options.add_argument(
+        "--image-dpi",
+        type=int,
+        default=150,
+        help="With --optimize-images, resolution of the printed images",
+    )
+    options.add_argument(
+        "--image-print-width",
+        type=float,
+        default=17,
+        help="With --optimize-images, width of the printable area of the page (in cm)",
+    )
+    options.add_argument(
+        "--save-profile",
+        choices=["fast", "compact", "web"],
+        default="fast",
+        help="How the PDF is saved. 'fast' only drops unused objects; "
+        "'compact' also merges duplicated objects and fonts, and compresses everything (slower); "
+        "'web' is 'compact' linearised, for progressive display while downloading (when supported)",
+    )
+    options.add_argument(
+        "--render-cache",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Reuse the cover pages, underlays and documents rendered by previous runs, "
+        "when their template, content and options are unchanged",
+    )
+    options.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="Folder of the render, image and compiled template caches. "
+        "Defaults to ~/.cache/notion-export-prettify",
+    )
+    options.add_argument(
+        "--cache-size",
+        type=int,
+        default=1024,
+        help="With --render-cache, maximum size of the render cache (in MB). "
+        "The least recently used entries are removed past that size",
+    )
+
+    # network
+    network = parser.add_argument_group(
+        "Network", description="How the documents load remote resources (stylesheets, embeds, hosted images...)"
+    )
+    network.add_argument(
+        "--remote-resources",
+        choices=["allow", "block"],
+        default="allow",
+        help="'block' only loads the remote resources of --allow-host, and those of --resource-mirror",
+    )
+    network.add_argument(
+        "--allow-host",
+        action="append",
+        default=None,
+        help="Host (and its subdomains) to load remote resources from with --remote-resources block. "
+        "Can be repeated",
+    )
+    network.add_argument(
+        "--resource-mirror",
+        type=str,
+        default=None,
+        help="Folder to serve remote resources from (as <host>/<path>) instead of the network. "
+        "Resources loaded from the network are saved to it",
+    )
+    network.add_argument(
+        "--resource-timeout",
+        type=float,
+        default=None,
+        help="Maximum time to load each remote resource (in seconds)",
+    )
+    network.add_argument(
+        "--wait-until",
+        choices=["load", "domcontentloaded", "networkidle", "commit"],
+        default="load",
+        help="What to wait for before printing a document: the 'load' event (default), "
+        "'domcontentloaded', 'networkidle' (no request for 500ms) or 'commit' (the response only)",
+    )
+
+    # previews
+    previews = parser.add_argument_group(
+        "Previews", description="Images of the first pages of the PDF generated"
+    )
+    previews.add_argument(
+        "--previews",
+        type=str,
+        default=None,
+        help="Folder to write a thumbnail of each previewed page to (<name>-page-<n>.png), "
+        "with a strip showing them side by side in perspective (<name>-strip.png)",
+    )
+    previews.add_argument(
+        "--preview-pages",
+        type=int,
+        default=4,
+        help="With --previews, number of pages previewed, from the first one",
+    )
+    previews.add_argument(
+        "--preview-dpi",
+        type=int,
+        default=100,
+        help="With --previews, resolution of the previews",
+    )
+    previews.add_argument(
+        "--preview-size",
+        type=int,
+        default=600,
+        help="With --previews, maximum width and height of each page (in pixels). "
+        "Larger pages are rendered at a lower resolution",
+    )
+
+    # profiling
+    profiling = parser.add_argument_group(
+        "Profiling", description="Time, memory and counters of each stage of the conversion"
+    )
+    profiling.add_argument(
+        "--profile-report",
+        type=str,
+        default=None,
+        help="Path of a JSON file to write the wall time, CPU time and peak memory of each stage to, "
+        "with counters (browser launches, bytes written...)",
+    )
+    profiling.add_argument(
+        "--profile-trace",
+        type=str,
+        default=None,
+        help="Path of a JSON file to write the stages to, as trace events (for chrome://tracing or Perfetto)",
+    )
+
+    # multi-page exports
+    workspace = parser.add_argument_group(
+        "Workspace", description="Options for exports containing several pages"
+    )
+    workspace.add_argument(
+        "--workspace",
+        action="store_true",
+        help="Convert every page of the export (including sub-pages) into its own PDF. "
+        "--output is then the folder to write them to",
+    )
+    workspace.add_argument(
+        "--merge",
+        action="store_true",
+        help="With --workspace, merge all pages into a single PDF, following the page hierarchy",
+    )
+    workspace.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="With --workspace, number of pages converted in parallel. Defaults to the number of CPUs",
+    )
 
     return parser.parse_args(sanitized_args)
@@ -0,0 +1,90 @@
+import logging
+import mimetypes
+import posixpath
+import zipfile
+from os import path
+from urllib.parse import quote, unquote, urlparse
+
+# Virtual origin that the documents are served from, instead of file:// URLs
+ORIGIN = "http://notion-export.local/"
+
+
+class DirectoryAssets:
+    """Assets read from a folder on disk"""
+
+    def __init__(self, dir):
+        self.dir = path.realpath(dir)
+
+    def read(self, name):
+        file_path = path.realpath(path.join(self.dir, name))
+        # Never serve anything outside of the folder
+        if not file_path.startswith(self.dir + path.sep) or not path.isfile(file_path):
+            return None
+        with open(file_path, "rb") as f:
+            return f.read()
+
+
+class ZipAssets:
+    """Assets read on demand from the export's zip file, without extracting it"""
+
+    def __init__(self, zip_ref: zipfile.ZipFile):
+        self.zip_ref = zip_ref
+
+    def read(self, name):
+        name = posixpath.normpath(name)
+        if name.startswith("../"):
+            return None
+        try:
+            return self.zip_ref.read(name)
+        except KeyError:
+            return None
+
+
+class MemoryAssets:
+    """Assets held in memory, falling back to other assets for the ones it doesn't have"""
+
+    def __init__(self, files: dict, fallback=None):
+        self.files = files
+        self.fallback = fallback
+
+    def read(self, name):
+        if name in self.files:
+            return self.files[name]
+        if self.fallback:
+            return self.fallback.read(name)
+
+
+class AssetServer:
+    """
+    Serves an HTML document from memory to a browser page, through request interception.
+    Its relative resources are fetched from `assets` (if any).
+    """
+
+    def __init__(self, html, assets=None, name="index.html"):
+        self.html = html.encode() if isinstance(html, str) else html
+        self.assets = assets
+        self.name = name
+        self.url = ORIGIN + quote(name)
+
+    def attach(self, page):
+        page.route(f"{ORIGIN}**", self.handle)
+
+    async def attach_async(self, page):
+        """Same as `attach`, for pages of Playwright's async API"""
+        await page.route(f"{ORIGIN}**", self.handle)
+
+    def handle(self, route):
+        # Returns what `route.fulfill` returns, for the async API to await it
+        name = unquote(urlparse(route.request.url).path).lstrip("/")
+        if name == self.name:
+            return route.fulfill(
+                status=200, body=self.html, content_type="text/html; charset=utf-8"
+            )
+
+        body = self.assets.read(name) if self.assets else None
+        if body is None:
+            logging.debug("Resource not found: %s", name)
+            return route.fulfill(status=404, body="")
+
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        return route.fulfill(status=200, body=body, content_type=content_type)
@@ -0,0 +1,214 @@
+import argparse
+import csv
+import glob
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os import path
+
+from .args import options_to_argv, parse_args
+from .browser_session import BrowserSession
+from .converter import Converter
+from .profiler import profile
+from .print_color import green, orange, red
+
+INPUT_EXTENSIONS = (".zip", ".html")
+
+
+def read_manifest(manifest_file):
+    """
+    Reads a CSV or JSONL manifest, with one document per row/line.
+    Each entry must have an `input` (relative to the manifest), and can have
+    `output`, `template` and any metadata or option (eg. `title`, `cover-page`)
+    """
+    manifest_dir = path.dirname(path.abspath(manifest_file))
+    with open(manifest_file, "r", newline="") as f:
+        if manifest_file.endswith(".csv"):
+            entries = list(csv.DictReader(f))
+        else:
+            entries = [json.loads(line) for line in f if line.strip()]
+
+    for entry in entries:
+        entry["input"] = path.join(manifest_dir, entry["input"])
+        if entry.get("output"):
+            entry["output"] = path.join(manifest_dir, entry["output"])
+    return entries
+
+
+def collect_entries(sources):
+    """Expands directories, glob patterns and manifests into a list of documents to convert"""
+    entries = []
+    for source in sources:
+        if path.isdir(source):
+            files = sorted(
+                path.join(source, f)
+                for f in os.listdir(source)
+                if f.endswith(INPUT_EXTENSIONS)
+            )
+            entries += [dict(input=f) for f in files]
+        elif source.endswith((".csv", ".jsonl")):
+            entries += read_manifest(source)
+        elif path.isfile(source):
+            entries.append(dict(input=source))
+        else:
+            entries += [dict(input=f) for f in sorted(glob.glob(source, recursive=True))]
+    return entries
+
+
+def entry_to_argv(entry, template=None, output_dir=None):
+    entry = dict(entry)
+    input_file = entry.pop("input")
+    output_file = entry.pop("output", None)
+    if not output_file and output_dir:
+        name = path.splitext(path.basename(input_file))[0]
+        output_file = path.join(output_dir, name + ".pdf")
+
+    if not entry.get("template"):
+        entry["template"] = template
+    argv = [input_file] + options_to_argv(entry.items())
+    if output_file:
+        argv += ["--output", output_file]
+    return argv
+
+
+def _init_worker():
+    # Each worker process keeps its own browser for all the documents it converts
+    BrowserSession.default().start()
+
+
+def _convert(args, converter_options=None):
+    started_at = time.monotonic()
+    result = dict(input=args.input_file)
+    # Stages of each conversion are reported (cheap enough to be always on)
+    with profile() as profiler:
+        try:
+            result["output"] = Converter(args, **(converter_options or {})).run()
+            result["status"] = "ok"
+        except Exception as e:
+            logging.exception("Conversion of %s failed", args.input_file)
+            result["status"] = "failed"
+            result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.monotonic() - started_at, 3)
+    result["profile"] = profiler.get_report()
+    return result
+
+
+def run_conversions(conversions, jobs=None, convert=_convert):
+    """
+    Runs all conversions in a pool of worker processes, and returns one result per conversion.
+    conversions: list of tuples of arguments for `convert`, the first one being the parsed args
+    """
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker) as pool:
+        futures = {
+            pool.submit(convert, *conversion): conversion[0]
+            for conversion in conversions
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker process died (eg. killed by the OOM killer)
+                result = dict(
+                    input=futures[future].input_file,
+                    status="failed",
+                    error=f"{type(e).__name__}: {e}",
+                )
+
+            if result["status"] == "ok":
+                green(f"[DONE] {result['input']} -> {result['output']}")
+            else:
+                red(f"[FAIL] {result['input']}: {result['error']}")
+            results.append(result)
+
+    return results
+
+
+def run_batch(entries, jobs=None, template=None, output_dir=None):
+    """Converts all entries in a pool of worker processes, and returns one result per entry"""
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    conversions = []
+    results = []
+    for entry in entries:
+        try:
+            args = parse_args(entry_to_argv(entry, template, output_dir))
+            conversions.append((args,))
+        except SystemExit:
+            red(f"[FAIL] {entry['input']}: Invalid options")
+            results.append(
+                dict(input=entry["input"], status="failed", error="Invalid options")
+            )
+
+    return results + run_conversions(conversions, jobs=jobs)
+
+
+def parse_batch_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="notion-export-prettify batch",
+        description="Convert many Notion exports in parallel.",
+    )
+    parser.add_argument(
+        "sources",
+        nargs="+",
+        help="Directories, glob patterns, input files or manifests (.csv or .jsonl)",
+    )
+    parser.add_argument(
+        "-t", "--template", type=str, help="Default template, for all documents"
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        type=str,
+        default=None,
+        help="Folder to write the PDF files to, when not set in the manifest",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of documents converted in parallel",
+    )
+    parser.add_argument(
+        "--report", type=str, default=None, help="Path to a JSON summary report"
+    )
+    return parser.parse_args(argv)
+
+
+def batch(argv):
+    args = parse_batch_args(argv)
+
+    entries = collect_entries(args.sources)
+    if not entries:
+        orange("[SKIP] No input files found")
+        return
+
+    started_at = time.monotonic()
+    results = run_batch(
+        entries, jobs=args.jobs, template=args.template, output_dir=args.output_dir
+    )
+    failed = [r for r in results if r["status"] != "ok"]
+
+    summary = dict(
+        documents=len(results),
+        succeeded=len(results) - len(failed),
+        failed=len(failed),
+        jobs=args.jobs,
+        seconds=round(time.monotonic() - started_at, 3),
+        results=results,
+    )
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    print_summary = red if failed else green
+    print_summary(
+        f"{summary['succeeded']}/{summary['documents']} documents converted "
+        f"in {summary['seconds']}s with {args.jobs} worker(s)"
+    )
+    if failed:
+        exit(1)
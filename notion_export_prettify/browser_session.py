@@ -0,0 +1,258 @@
+import asyncio
+import atexit
+import contextvars
+import logging
+import threading
+from contextlib import contextmanager
+
+from .print_color import is_quiet, set_quiet
+from .profiler import count, get_profiler, use_profiler
+
+_local = threading.local()
+
+
+def playwright_error():
+    """
+    The class of Playwright's errors.
+    Playwright is only imported when a browser starts, for commands that render nothing to start faster.
+    """
+    from playwright.sync_api import Error
+
+    return Error
+
+
+class BrowserSession:
+    """
+    A Chromium instance, started on first use and shared by all renders.
+
+    Each render gets its own (cheap) browser context and page.
+    If the browser crashes or gets disconnected, it is restarted on the next render.
+
+    NOTE: Playwright's sync API is bound to the thread that started it.
+     A session must therefore only be used from the thread that created it.
+     Renders with the async API run through `run_async`, as that thread can't run an event loop of its own.
+    """
+
+    def __init__(self, **launch_options):
+        self.launch_options = launch_options
+        self.playwright = None
+        self.browser = None
+        self.launches = 0
+        self.render_loop = None
+
+    @classmethod
+    def default(cls):
+        """The session shared by the current thread, created if needed"""
+        session = getattr(_local, "session", None)
+        if session is None:
+            session = cls()
+            _local.session = session
+            atexit.register(session._close_at_exit)
+        return session
+
+    def start(self):
+        if self.browser and self.browser.is_connected():
+            return self.browser
+
+        if self.browser:
+            logging.warning("Browser is disconnected. Restarting it")
+            self._close_browser()
+
+        if not self.playwright:
+            from playwright.sync_api import sync_playwright
+
+            self.playwright = sync_playwright().start()
+
+        logging.debug("Launching Chromium")
+        self.browser = self.playwright.chromium.launch(**self.launch_options)
+        self.launches += 1
+        count("browser_launches")
+        return self.browser
+
+    @contextmanager
+    def new_page(self):
+        context = self.start().new_context()
+        try:
+            yield context.new_page()
+        finally:
+            try:
+                context.close()
+            except playwright_error() as e:
+                logging.debug("Could not close browser context: %s", e)
+
+    def run(self, render, retries=1):
+        """
+        Calls `render` with a fresh page, and returns its result.
+        If the browser crashed in the meantime, the render is retried on a new browser.
+        """
+        count("browser_renders")
+        while True:
+            try:
+                with self.new_page() as page:
+                    return render(page)
+            except playwright_error():
+                if retries <= 0 or (self.browser and self.browser.is_connected()):
+                    raise
+                retries -= 1
+                logging.warning("Browser crashed during render. Retrying")
+
+    def run_async(self, function):
+        """
+        Awaits `function(session)` with the AsyncBrowserSession of this session, and returns its result.
+        It runs on a loop thread of its own (see RenderLoop), started on first use and kept until `close`
+        """
+        if self.render_loop is None:
+            self.render_loop = RenderLoop(**self.launch_options)
+        return self.render_loop.run(function)
+
+    def _close_browser(self):
+        try:
+            self.browser.close()
+        except playwright_error() as e:
+            logging.debug("Could not close browser: %s", e)
+        self.browser = None
+
+    def close(self):
+        if self.render_loop:
+            self.render_loop.close()
+            self.render_loop = None
+        if self.browser:
+            self._close_browser()
+        if self.playwright:
+            self.playwright.stop()
+            self.playwright = None
+
+        if getattr(_local, "session", None) is self:
+            _local.session = None
+
+    def _close_at_exit(self):
+        try:
+            self.close()
+        except Exception as e:
+            logging.debug("Could not close browser session: %s", e)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class AsyncBrowserSession:
+    """
+    Same as BrowserSession, with Playwright's async API: renders can run concurrently in the same browser,
+    each in its own context and page.
+    """
+
+    def __init__(self, **launch_options):
+        self.launch_options = launch_options
+        self.playwright = None
+        self.browser = None
+        self.launches = 0
+        self.lock = asyncio.Lock()
+
+    async def start(self):
+        # Concurrent renders wait for the same browser to start
+        async with self.lock:
+            if self.browser and self.browser.is_connected():
+                return self.browser
+
+            if self.browser:
+                logging.warning("Browser is disconnected. Restarting it")
+                await self._close_browser()
+
+            if not self.playwright:
+                from playwright.async_api import async_playwright
+
+                self.playwright = await async_playwright().start()
+
+            logging.debug("Launching Chromium")
+            self.browser = await self.playwright.chromium.launch(**self.launch_options)
+            self.launches += 1
+            count("browser_launches")
+            return self.browser
+
+    async def run(self, render, retries=1):
+        """Awaits `render` with a fresh page, and returns its result (see BrowserSession.run)"""
+        count("browser_renders")
+        while True:
+            try:
+                browser = await self.start()
+                context = await browser.new_context()
+                try:
+                    return await render(await context.new_page())
+                finally:
+                    try:
+                        await context.close()
+                    except playwright_error() as e:
+                        logging.debug("Could not close browser context: %s", e)
+            except playwright_error():
+                if retries <= 0 or (self.browser and self.browser.is_connected()):
+                    raise
+                retries -= 1
+                logging.warning("Browser crashed during render. Retrying")
+
+    async def _close_browser(self):
+        try:
+            await self.browser.close()
+        except playwright_error() as e:
+            logging.debug("Could not close browser: %s", e)
+        self.browser = None
+
+    async def close(self):
+        if self.browser:
+            await self._close_browser()
+        if self.playwright:
+            await self.playwright.stop()
+            self.playwright = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+class RenderLoop:
+    """
+    An event loop running in a thread of its own, with an AsyncBrowserSession kept open between runs.
+
+    Playwright's sync API leaves the thread that uses it with a running event loop, where asyncio.run() fails:
+    the calling thread hands its coroutines over to this loop instead, and waits for them.
+    They print and are profiled as the calling thread would.
+    """
+
+    def __init__(self, **launch_options):
+        self.session = AsyncBrowserSession(**launch_options)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="render-loop", daemon=True)
+        self.thread.start()
+
+    def run(self, function):
+        """Awaits `function(session)` on the loop, and returns its result"""
+        quiet, profiler = is_quiet(), get_profiler()
+        context = contextvars.copy_context()
+
+        async def run_as_caller():
+            # The task has a context of its own: it gets the caller's values (eg. the stage being profiled)
+            for variable, value in context.items():
+                variable.set(value)
+            set_quiet(quiet)
+            with use_profiler(profiler):
+                return await function(self.session)
+
+        future = asyncio.run_coroutine_threadsafe(run_as_caller(), self.loop)
+        try:
+            return future.result()
+        except BaseException:
+            # eg. KeyboardInterrupt: the coroutine must not keep running without the caller
+            future.cancel()
+            raise
+
+    def close(self):
+        try:
+            asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result()
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
@@ -0,0 +1,577 @@
+import json
+import logging
+import os
+import posixpath
+import shutil
+import tempfile
+import time
+import zipfile
+from importlib.metadata import version
+from os import listdir, path
+
+import fitz  # PyMuPDF
+
+from .asset_server import DirectoryAssets, MemoryAssets, ZipAssets
+from .browser_session import BrowserSession
+from .document_chunks import DocumentSplitter
+from .exceptions import InvalidExportError
+from .html_templator import HtmlTemplator
+from .image_optimizer import ImageOptimizer, default_cache_dir
+from .notion_html_manipulator import NotionHtmlManipulator
+from .pdf_maker import PdfMaker
+from .preview import PreviewMaker
+from .print_color import green, orange
+from .profiler import profiled, stage
+from .render_cache import RenderCache, file_digest, folder_digest
+from .resource_policy import ResourcePolicy
+from .resource_loader import TemplateBundle, TemplateCache
+
+
+# Options that have no effect on the PDF generated (besides where it is written),
+# or that only change how the same PDF is generated
+NON_RENDERING_OPTIONS = [
+    "input_file",
+    "output",
+    "jobs",
+    "render_cache",
+    "cache_dir",
+    "cache_size",
+    "log_level",
+    "watch",
+    "workspace",
+    "merge",
+    "profile_report",
+    "profile_trace",
+    "concurrent",
+    "in_memory",
+    "lazy_assets",
+    "html_parser",
+    "previews",
+    "preview_pages",
+    "preview_dpi",
+    "preview_size",
+]
+
+
+class Converter:
+    """
+    Runs the whole conversion of a Notion export into a PDF document.
+
+    args: the options and metadata, as returned by `args.parse_args`
+    session: the browser to render with. Defaults to the one shared by the current thread
+    resources: the template resources. Defaults to the bundle of `args.template` shared by the process
+    cache: where to reuse covers and underlays from. Defaults to the render cache on disk, with --render-cache
+    keep_previews: render the previews of the document (as with --previews), kept in `thumbnails` and `strip`
+    """
+
+    def __init__(
+        self,
+        args,
+        session: BrowserSession = None,
+        resources: TemplateBundle = None,
+        link_map: dict = None,
+        cache: RenderCache = None,
+        keep_previews=False,
+    ):
+        self.args = args
+        self.session = session or BrowserSession.default()
+        # Links to other pages of the export (by absolute path), and what they should point to instead
+        self.link_map = link_map
+
+        if resources is None:
+            # Template dir is the one containing the template config file
+            resources = TemplateCache.default(args.cache_dir).get_resources(args.template)
+        self.resources = resources
+
+        # 0. Determine if there will be a title page
+        self.with_cover_page = args.cover_page and bool(
+            resources.get_resource_path("cover.html")
+            or resources.get_resource_path("cover.pdf")
+        )
+
+        # Get page.css
+        self.page_css = resources.get_resource_content("page.css")
+        self.metadata = None
+
+        # How the documents load remote resources, and those that were blocked or slow
+        self.resource_policy = ResourcePolicy.from_args(args)
+
+        # PNG images of the first pages of the PDF generated
+        self.keep_previews = keep_previews
+        self.thumbnails = None
+        self.strip = None
+
+        # Where the resources of the document are read from
+        self.assets = None
+        self.zip_ref = None
+
+        # Cover, underlays and whole documents rendered by previous runs
+        self.cache_dir = args.cache_dir or default_cache_dir()
+        self.cache = cache
+        # Whole documents are only cached on disk, where all entries depend on the template files
+        self.cache_output = False
+        self.output_cache_key = None
+        if cache is None and args.render_cache:
+            self.cache = RenderCache(
+                path.join(self.cache_dir, "renders"),
+                max_size=args.cache_size * 1024**2,
+                context=folder_digest(resources.dir) if resources.dir else "",
+            )
+            self.cache_output = not link_map
+
+    @profiled("convert")
+    def run(self, output_file=None):
+        """Converts the input file, and returns the path of the PDF file generated"""
+        if self.cache_output:
+            self.output_cache_key = self.get_output_cache_key()
+            if cached_output := self.load_cached_output(output_file):
+                return cached_output
+
+        # Create a temporary directory to extract the zip file to
+        with tempfile.TemporaryDirectory() as temp_dir:
+            try:
+                pdf_maker, manipulator = self.render_main(temp_dir)
+            finally:
+                self.close_input()
+
+            self.add_underlay(pdf_maker)
+            self.add_background(pdf_maker)
+            self.add_cover_page(pdf_maker)
+
+            # 3. - Add PDF TOC
+            green("[PROC] Building PDF TOC")
+            pdf_maker.make_toc(manipulator.get_heading_map())
+
+            self.add_metadata(pdf_maker)
+            return self.save(pdf_maker, output_file)
+
+    def render_main(self, temp_dir):
+        """Renders the main document (without header, footers and cover), and returns the PdfMaker and manipulator"""
+        logging.debug("Temporary directory: %s", temp_dir)
+        html_file = self.extract_input(temp_dir)
+
+        # 1. - Manipulate the HTML
+        manipulator = self.manipulate_html(html_file)
+
+        # 1.f. - Downsample images
+        if self.args.optimize_images:
+            green("[PROC] Optimising images")
+            self.optimize_images(manipulator, temp_dir)
+        else:
+            orange("[SKIP] Images kept as original")
+
+        return self.render_document(manipulator, temp_dir), manipulator
+
+    @profiled("render_main")
+    def render_document(self, manipulator, temp_dir):
+        """Renders the manipulated HTML document, and returns its PdfMaker"""
+        # 2. - Convert to PDF
+        pdf_maker = PdfMaker(
+            temp_dir=temp_dir,
+            session=self.session,
+            in_memory=self.args.in_memory,
+            cache=self.cache,
+            resource_policy=self.resource_policy,
+        )
+        green("[PROC] Generating main PDF document")
+        if self.zip_ref and not self.args.in_memory:
+            self.extract_resources(manipulator.get_resource_urls(), temp_dir)
+
+        if chunks := self.get_chunks(manipulator):
+            pdf_maker.from_html_chunks(chunks, self.assets)
+        elif self.args.in_memory:
+            pdf_maker.from_html_bytes(manipulator.get_html(), self.assets)
+        else:
+            # 1.x. - Save to file
+            updated_html_path = path.join(temp_dir, "updated_doc.html")
+            with open(updated_html_path, "w") as f:
+                f.write(manipulator.get_html())
+                logging.debug("Updated HTML saved to %s", updated_html_path)
+
+            pdf_maker.from_html_file(updated_html_path)
+        return pdf_maker
+
+    def get_chunks(self, manipulator):
+        """With --render-chunks, the main document split into chunks to render concurrently (None otherwise)"""
+        if self.args.render_chunks < 2:
+            return None
+
+        with stage("split"):
+            chunks = DocumentSplitter(manipulator).get_chunks(self.args.render_chunks)
+        if len(chunks) < 2:
+            orange("[SKIP] No top-level headings to split the document at. Rendering it at once")
+            return None
+        green(f"[PROC] Rendering the main document in {len(chunks)} chunks")
+        return chunks
+
+    @profiled("optimize_images")
+    def optimize_images(self, manipulator, temp_dir):
+        optimizer = ImageOptimizer(
+            dpi=self.args.image_dpi,
+            print_width=self.args.image_print_width,
+            cache_dir=path.join(self.cache_dir, "images"),
+        )
+        files = optimizer.optimize(manipulator.soup, self.assets)
+
+        if self.args.in_memory:
+            self.assets = MemoryAssets(files, fallback=self.assets)
+            return
+
+        for name, data in files.items():
+            file_path = path.join(temp_dir, name)
+            os.makedirs(path.dirname(file_path), exist_ok=True)
+            with open(file_path, "wb") as f:
+                f.write(data)
+
+    @profiled("extract")
+    def extract_input(self, temp_dir):
+        """Extracts the input into the temporary directory, and returns the path to its HTML file"""
+        input_file = self.args.input_file
+
+        if input_file.endswith(".zip") and self.args.lazy_assets:
+            return self.open_zip(input_file, temp_dir)
+
+        if input_file.endswith(".zip"):
+            with zipfile.ZipFile(input_file, "r") as zip_ref:
+                zip_ref.extractall(temp_dir)
+        elif input_file.endswith(".html"):
+            # If the input file is an HTML file, just copy it to the temporary directory
+            logging.debug("Copying HTML file to temporary directory")
+            shutil.copy(input_file, temp_dir)
+            # as well as the associated folder with the same name (if any)
+            input_asset_folder = input_file.replace(".html", "")
+            if path.exists(input_asset_folder):
+                shutil.copytree(
+                    input_asset_folder,
+                    path.join(temp_dir, path.basename(input_asset_folder)),
+                )
+        else:
+            raise InvalidExportError("Unsupported input file format")
+
+        # Find the single HTML file in that folder
+        html_files = [f for f in listdir(temp_dir) if f.endswith(".html")]
+        if len(html_files) != 1:
+            raise InvalidExportError(
+                "Expected one HTML file in the zip file. Use --workspace for multi-page exports"
+            )
+        self.assets = DirectoryAssets(temp_dir)
+        return path.join(temp_dir, html_files[0])
+
+    def open_zip(self, input_file, temp_dir):
+        """Only extracts the HTML file of the zip. Its resources are read from the zip when needed"""
+        self.zip_ref = zipfile.ZipFile(input_file, "r")
+        html_files = [
+            name
+            for name in self.zip_ref.namelist()
+            if name.endswith(".html") and "/" not in name
+        ]
+        if len(html_files) != 1:
+            raise InvalidExportError(
+                "Expected one HTML file in the zip file. Use --workspace for multi-page exports"
+            )
+        self.assets = ZipAssets(self.zip_ref)
+        return self.zip_ref.extract(html_files[0], temp_dir)
+
+    def extract_resources(self, urls, temp_dir):
+        """Extracts the resources referenced by the document, for it to be rendered from a file"""
+        members = set(self.zip_ref.namelist())
+        for url in urls:
+            name = posixpath.normpath(url)
+            if name in members:
+                logging.debug("Extracting %s", name)
+                self.zip_ref.extract(name, temp_dir)
+
+    def close_input(self):
+        if self.zip_ref:
+            self.zip_ref.close()
+            self.zip_ref = None
+
+    @profiled("manipulate")
+    def manipulate_html(self, html_file):
+        args = self.args
+
+        with stage("parse"):
+            manipulator = NotionHtmlManipulator(html_file, parser=self.args.html_parser)
+
+        # Prepare metadata
+        self.set_metadata(manipulator)
+
+        # Links to other pages of the export
+        if self.link_map:
+            manipulator.rewrite_page_links(
+                path.dirname(path.abspath(self.args.input_file)), self.link_map
+            )
+
+        # 1.a. - Overwrite CSS
+        self.inject_css(manipulator)
+
+        # All manipulations below are applied in a single pass over the document
+        rules = []
+
+        # 1.b. - Remove internal info
+        if args.strip_internal_info:
+            green("[PROC] Removing internal info")
+            rules.append(manipulator.internal_info_rule())
+            rules.append(manipulator.database_properties_rule())
+        else:
+            orange("[SKIP] Keeping internal info (if any)")
+
+        # 1.c. - Number headings
+        if args.heading_numbers:
+            green("[PROC] Numbering headings")
+            rules.append(manipulator.heading_numbers_rule())
+        else:
+            orange("[SKIP] Headings kept as original")
+
+        # 1.d. - Reset TOC
+        if args.table_of_contents:
+            green("[PROC] Processing TOC (if any in source)")
+            rules.append(manipulator.toc_rule(keep=True))
+        else:
+            green("[PROC] Removing TOC (if any)")
+            rules.append(manipulator.toc_rule(keep=False))
+
+        # 1.e. - handle Notion's header (title)
+        if self.with_cover_page:
+            green("[PROC] Removing header from source (in favour of cover page)")
+            rules.append(manipulator.remove_header_rule())
+        elif header_rule := self.header_rule(manipulator):
+            rules.append(header_rule)
+
+        # The heading map (for the PDF TOC) is collected in the same pass,
+        # and all headings are linked to, for them to be named destinations in the PDF
+        rules.append(manipulator.heading_map_rule())
+        rules.append(manipulator.outline_anchors_rule())
+        manipulator.apply(rules)
+
+        return manipulator
+
+    @profiled("update_html")
+    def update_html(self, manipulator):
+        """
+        Updates the metadata and CSS of a document manipulated by a previous converter (as in watch mode),
+        without manipulating it again
+        """
+        self.set_metadata(manipulator)
+        self.inject_css(manipulator)
+        if not self.with_cover_page and (header_rule := self.header_rule(manipulator)):
+            manipulator.apply([header_rule, manipulator.heading_map_rule()])
+
+    def set_metadata(self, manipulator):
+        args = self.args
+        self.metadata = {
+            "title": args.title or manipulator.get_title(),
+            "description": args.description or manipulator.get_description(),
+            "subtitle": args.subtitle or "",
+            "project": args.project or "",
+            "author": args.author or "",
+            "date": args.date or "",
+            "identifier": args.identifier or "",
+        }
+
+    def inject_css(self, manipulator):
+        """Adds page.css and overwrites.css to the document, or updates them if already added"""
+        for filename, css in (
+            ("page.css", self.page_css),
+            ("overwrites.css", self.resources.get_resource_content("overwrites.css")),
+        ):
+            if style_tag := manipulator.style_tags.get(filename):
+                style_tag.string = css or ""
+            elif css:
+                green(f"[PROC] Injecting {filename}")
+                manipulator.style_tags[filename] = manipulator.add_css_overwrites(css)
+            else:
+                orange(f"[SKIP] No {filename} found")
+
+    def header_rule(self, manipulator):
+        """Rule replacing Notion's header by the header template, if any"""
+        if header_template := self.resources.get_template("header.html"):
+            green("[PROC] Rendering and injecting new header block")
+            title_block = HtmlTemplator(header_template).inject(self.metadata).html
+            return manipulator.title_block_rule(title_block)
+        orange("[SKIP] No HTML title template found. Keeping original header")
+
+    @profiled("underlay")
+    def add_underlay(self, pdf_maker):
+        # 2.a. - Add header/footer underlay
+        # NOTE: this cannot be done as an overlay, due to a bug in PyMuPDF
+        if underlay_html := self.get_underlay_html():
+            pdf_maker.merge_underlay_html(underlay_html)
+
+    def get_underlay_html(self):
+        """The underlay template, rendered with the metadata (None if the template has no underlay)"""
+        if underlay_template := self.resources.get_template("background.html"):
+            green("[PROC] Rendering underlay templates for each page")
+            return (
+                HtmlTemplator(underlay_template, parser=self.args.html_parser)
+                .inject(
+                    self.metadata,
+                    pageNumber="__PAGENUMBER__",
+                    hasCoverPage="hasCoverPage" if self.with_cover_page else "",
+                )
+                .add_css(self.page_css)
+                .html
+            )
+        orange(
+            "[SKIP] No HTML overlay template found. No headers and footers will be added"
+        )
+
+    @profiled("background")
+    def add_background(self, pdf_maker):
+        # 2.b. - Merge branding background
+        if background_file := self.resources.get_resource_path("background.pdf"):
+            pdf_maker.merge_background_pdf(background_file)
+            green("[PROC] Merging background PDF")
+        else:
+            orange("[SKIP] No PDF background file found")
+
+    @profiled("cover")
+    def add_cover_page(self, pdf_maker):
+        # 2.c. - Add cover page
+        if self.with_cover_page:
+            cover_page_file, cover_html = self.get_cover_page()
+            green("[PROC] Prefixing with cover page")
+            pdf_maker.prepend_cover_page(cover_page_file, cover_html)
+        else:
+            orange("[SKIP] Skipping cover page")
+
+    def get_cover_page(self):
+        """The cover PDF (if any), and the cover template rendered with the metadata"""
+        cover_html = "<html></html>"
+        cover_template = self.resources.get_template("cover.html")
+        if cover_template:
+            green("[PROC] Rendering cover template")
+            cover_html = (
+                HtmlTemplator(cover_template, parser=self.args.html_parser)
+                .inject(self.metadata)
+                .add_css(self.page_css)
+                .html
+            )
+        else:
+            orange("[SKIP] No HTML cover template found")
+
+        cover_page_file = self.resources.get_resource_path("cover.pdf")
+        if not cover_page_file:
+            orange("[SKIP] No PDF cover page file found")
+        return cover_page_file, cover_html
+
+    @profiled("metadata")
+    def add_metadata(self, pdf_maker):
+        # 4. - Add metadata
+        green("[PROC] Adding metadata")
+        pdf_maker.set_metadata(
+            dict(
+                title=self.metadata["title"],
+                creator="Notion",
+                producer=f"notion-export-prettify v{version('notion-export-prettify')}",
+                author=self.metadata["author"],
+                subject=self.metadata["description"],
+            )
+        )
+
+    @profiled("save")
+    def save(self, pdf_maker, output_file=None):
+        # 5. - Save to file
+        output_file = output_file or self.args.output or self.get_output_file()
+        started_at = time.perf_counter()
+        size = pdf_maker.save(output_file, self.args.save_profile)
+
+        green(
+            "[PROC] Saved with the '%s' profile: %.1f KB in %.2fs"
+            % (self.args.save_profile, size / 1024, time.perf_counter() - started_at)
+        )
+        green("PDF generated at %s" % output_file)
+        self.report_resources()
+
+        if self.args.previews or self.keep_previews:
+            self.make_previews(pdf_maker.pdf_doc, output_file)
+
+        if self.cache:
+            if self.output_cache_key:
+                with open(output_file, "rb") as f:
+                    self.cache.put(self.output_cache_key, f.read())
+                self.cache.put(
+                    self.output_cache_key, json.dumps(self.metadata).encode(), ".json"
+                )
+            logging.debug(
+                "Render cache: %s hits, %s misses", self.cache.hits, self.cache.misses
+            )
+            self.cache.evict()
+        return output_file
+
+    def report_resources(self):
+        """Prints the remote resources that were blocked, failed or slow to load"""
+        report = self.resource_policy.get_report()
+        if report["blocked"]:
+            orange(f"[SKIP] Blocked {len(report['blocked'])} remote resources")
+        for resource in report["failed"]:
+            logging.warning("Remote resource failed to load: %s (%s)", resource["url"], resource["error"])
+        for resource in report["slow"]:
+            logging.warning("Slow remote resource: %s (%.2fs)", resource["url"], resource["seconds"])
+        if report["mirrored"]:
+            logging.debug("%s remote resources served from the mirror", report["mirrored"])
+
+    def get_output_cache_key(self):
+        """Key of the whole document in the render cache: the input export, and the options"""
+        input_file = self.args.input_file
+        input_digest = file_digest(input_file)
+        # An HTML export has its resources in the folder with the same name
+        input_asset_folder = input_file.replace(".html", "")
+        if input_file.endswith(".html") and path.isdir(input_asset_folder):
+            input_digest += folder_digest(input_asset_folder)
+
+        options = {
+            key: value
+            for key, value in vars(self.args).items()
+            if key not in NON_RENDERING_OPTIONS
+        }
+        # Chunked renders only match a single one with templates breaking pages before each h1 heading.
+        # Below 2 chunks, the document is rendered at once
+        options["render_chunks"] = max(options["render_chunks"], 1)
+        return self.cache.make_key(
+            "output", input_digest, json.dumps(options, sort_keys=True, default=str)
+        )
+
+    def load_cached_output(self, output_file=None):
+        """Writes the PDF generated by a previous run from the same export, if any, and returns its path"""
+        data = self.cache.get(self.output_cache_key)
+        metadata = self.cache.get(self.output_cache_key, ".json")
+        if data is None or metadata is None:
+            return None
+
+        # The metadata gives the default output file name
+        self.metadata = json.loads(metadata)
+        output_file = output_file or self.args.output or self.get_output_file()
+        with open(output_file, "wb") as f:
+            f.write(data)
+
+        green("[PROC] Unchanged export: reusing the PDF from the render cache")
+        green("PDF generated at %s" % output_file)
+
+        if self.args.previews or self.keep_previews:
+            self.make_previews(fitz.open(stream=data, filetype="pdf"), output_file)
+        return output_file
+
+    @profiled("preview")
+    def make_previews(self, doc, output_file):
+        """Renders the thumbnails and strip of the first pages, and writes them to the --previews folder"""
+        preview_maker = PreviewMaker(
+            pages=self.args.preview_pages,
+            dpi=self.args.preview_dpi,
+            max_size=self.args.preview_size,
+        )
+        self.thumbnails, self.strip = preview_maker.make_previews(doc)
+        if self.args.previews:
+            name = path.splitext(path.basename(output_file))[0]
+            files = preview_maker.write_previews(
+                self.thumbnails, self.strip, self.args.previews, name
+            )
+            green(f"[PROC] Wrote {len(files)} previews to {self.args.previews}")
+
+    def get_output_file(self):
+        filename = self.metadata["title"] + ".pdf"
+        if "project" in self.metadata:
+            filename = self.metadata["project"] + " - " + filename
+
+        # Save in the same directory as the input with the title as filename
+        return path.join(path.dirname(self.args.input_file), filename)
@@ -0,0 +1,242 @@
+import html
+import logging
+from contextlib import contextmanager
+from urllib.parse import quote, unquote
+
+import fitz  # PyMuPDF
+from bs4 import Comment
+
+from .notion_html_manipulator import NotionHtmlManipulator
+
+# Links to elements of other chunks are rendered as links to this URL,
+# and turned back into internal links once the chunks are stitched together
+CHUNK_LINK_PREFIX = "https://notion-export-prettify.invalid/anchor/"
+
+CHUNK_MARKER = "notion-export-prettify-chunk"
+
+
+class DocumentSplitter:
+    """
+    Splits a manipulated document at its top-level h1 headings, into documents of similar size to render separately.
+
+    Each chunk starts on a new page: the output only matches a single render with templates that break pages
+    before h1 headings (as the built-in ones do).
+    Links to elements of other chunks point to CHUNK_LINK_PREFIX, and each chunk links to its own elements
+    that are linked to (in a hidden block), for Chromium to create their named destinations.
+    """
+
+    def __init__(self, manipulator: NotionHtmlManipulator):
+        self.manipulator = manipulator
+        self.soup = manipulator.soup
+        self.page_body = manipulator.page_body
+
+    def get_sections(self):
+        """The children of the page body, grouped in sections starting with a top-level h1 heading"""
+        h1s = {
+            id(heading)
+            for heading in self.manipulator.index.get_headings()
+            if heading.name == "h1" and heading.parent is self.page_body
+        }
+        sections = [[]]
+        for child in self.page_body.contents:
+            if id(child) in h1s and sections[-1]:
+                sections.append([])
+            sections[-1].append(child)
+        return sections
+
+    def get_chunks(self, count):
+        """The document split into (at most) `count` HTML documents"""
+        sections = self.get_sections()
+        sizes = [sum(len(str(child)) for child in section) for section in sections]
+        target = sum(sizes) / count
+
+        chunks = [[]]
+        done = 0
+        for section, size in zip(sections, sizes):
+            if chunks[-1] and len(chunks) < count and done >= target * len(chunks):
+                chunks.append([])
+            chunks[-1] += section
+            done += size
+        if len(chunks) < 2:
+            return [self.manipulator.get_html()]
+
+        logging.debug(
+            "Splitting %s sections into %s chunks", len(sections), len(chunks)
+        )
+        return self.serialize_chunks(chunks)
+
+    def serialize_chunks(self, chunks):
+        # Ids of the elements of each chunk, and the targets of the links of the whole document
+        chunk_ids = []
+        targets = set()
+        for children in chunks:
+            ids = set()
+            for child in children:
+                if getattr(child, "name", None) is None:
+                    continue
+                if child.get("id"):
+                    ids.add(child["id"])
+                ids.update(element["id"] for element in child.find_all(id=True))
+                targets.update(
+                    link["href"][1:]
+                    for link in child.find_all("a", href=True)
+                    if link["href"].startswith("#")
+                )
+            chunk_ids.append(ids)
+
+        first_shell, shell = self.get_shells()
+        documents = []
+        for i, (children, ids) in enumerate(zip(chunks, chunk_ids)):
+            prefix, suffix = (first_shell if i == 0 else shell).split(
+                f"<!--{CHUNK_MARKER}-->"
+            )
+            anchors = "".join(
+                f'<a href="#{html.escape(target)}"></a>' for target in sorted(targets & ids)
+            )
+            with self.external_links(children, ids):
+                body = "".join(str(child) for child in children)
+            documents.append(
+                f'{prefix}{body}<div class="pdf-chunk-anchors" style="display: none">{anchors}</div>{suffix}'
+            )
+        return documents
+
+    def get_shells(self):
+        """
+        The document without the content of its page body (replaced by a marker),
+        with its header (for the first chunk), and without it (for the others)
+        """
+        children = list(self.page_body.contents)
+        for child in children:
+            child.extract()
+        marker = Comment(CHUNK_MARKER)
+        self.page_body.append(marker)
+
+        header = self.manipulator.header
+        if header is not None and header.parent is None:
+            # Already removed (in favour of the cover page)
+            header = None
+        try:
+            first_shell = str(self.soup)
+            if header is None:
+                return first_shell, first_shell
+
+            parent = header.parent
+            index = parent.index(header)
+            header.extract()
+            try:
+                return first_shell, str(self.soup)
+            finally:
+                parent.insert(index, header)
+        finally:
+            marker.extract()
+            for child in children:
+                self.page_body.append(child)
+
+    @contextmanager
+    def external_links(self, children, ids):
+        """Points the links of `children` to elements of other chunks to CHUNK_LINK_PREFIX, until the block exits"""
+        links = [
+            link
+            for child in children
+            if getattr(child, "name", None) is not None
+            for link in child.find_all("a", href=True)
+            if link["href"].startswith("#") and link["href"][1:] not in ids
+        ]
+        hrefs = [link["href"] for link in links]
+        for link, href in zip(links, hrefs):
+            link["href"] = CHUNK_LINK_PREFIX + quote(href[1:])
+        try:
+            yield
+        finally:
+            for link, href in zip(links, hrefs):
+                link["href"] = href
+
+
+def pdf_name(name):
+    """`name` as a PDF name object (without its leading slash)"""
+    return "".join(
+        c
+        if 33 <= ord(c) <= 126 and c not in "()<>[]{}/%#"
+        else "".join(f"#{b:02X}" for b in c.encode())
+        for c in name
+    )
+
+
+def set_destinations(doc, destinations):
+    """Sets the named destinations of the document (name -> dict(page, to, zoom), as given by `resolve_names`)"""
+    entries = []
+    for name, destination in destinations.items():
+        left, top = destination.get("to") or (0, 0)
+        page_xref = doc[destination["page"]].xref
+        zoom = destination.get("zoom") or 0
+        entries.append(f"/{pdf_name(name)}[{page_xref} 0 R/XYZ {left:g} {top:g} {zoom:g}]")
+
+    xref = doc.get_new_xref()
+    doc.update_object(xref, "<<" + "".join(entries) + ">>")
+    doc.xref_set_key(doc.pdf_catalog(), "Dests", f"{xref} 0 R")
+
+
+def stitch_documents(docs):
+    """
+    Concatenates the documents rendered from the chunks of a document, and restores what concatenating loses:
+    named destinations, links (including those between chunks) and page labels.
+    Underlays and the outline are added to the stitched document, so page numbers follow on.
+    """
+    stitched = fitz.open()
+    destinations = {}
+    links = []
+    labels = []
+    for doc in docs:
+        offset = len(stitched)
+        for name, destination in doc.resolve_names().items():
+            if destination.get("page", -1) >= 0:
+                destinations.setdefault(
+                    name, dict(destination, page=destination["page"] + offset)
+                )
+        # Links are inserted again once all pages are: copying them with the pages drops named links,
+        # and turns links to files into links to other PDF documents
+        for page in doc:
+            links += [(page.number + offset, offset, get_link(doc, link)) for link in page.get_links()]
+        for label in doc.get_page_labels():
+            labels.append(dict(label, startpage=label["startpage"] + offset))
+        stitched.insert_pdf(doc, links=False)
+
+    if destinations:
+        set_destinations(stitched, destinations)
+    if labels:
+        stitched.set_page_labels(labels)
+
+    for page_number, offset, link in links:
+        if link := get_stitched_link(link, offset, destinations):
+            stitched[page_number].insert_link(link)
+    return stitched
+
+
+def get_link(doc, link):
+    """`link` as returned by `get_links`, with the original URI of links to files (reported as launch links)"""
+    if link.get("xref") and doc.xref_get_key(link["xref"], "A/S")[1] == "/URI":
+        uri = doc.xref_get_key(link["xref"], "A/URI")[1]
+        return {"kind": fitz.LINK_URI, "from": link["from"], "uri": uri}
+    return link
+
+
+def get_stitched_link(link, offset, destinations):
+    """
+    `link` of a chunk (whose first page is at `offset` in the stitched document),
+    pointing to the same target in the stitched document (None if there is none)
+    """
+    link = {key: value for key, value in link.items() if key not in ("xref", "id")}
+    uri = link.get("uri") or ""
+    if link["kind"] == fitz.LINK_URI and uri.startswith(CHUNK_LINK_PREFIX):
+        name = unquote(uri[len(CHUNK_LINK_PREFIX) :])
+        link = {"kind": fitz.LINK_NAMED, "from": link["from"], "nameddest": name}
+    elif link["kind"] == fitz.LINK_GOTO:
+        link["page"] += offset
+
+    if link["kind"] == fitz.LINK_NAMED:
+        destination = destinations.get(link["nameddest"])
+        if destination is None:
+            logging.debug(f"No destination for link to #{link['nameddest']}")
+            return None
+        link.update(name=link["nameddest"], page=destination["page"])
+    return link
@@ -0,0 +1,44 @@
+class DocumentIndex:
+    """
+    Lookup tables for the links and headings of a document, built once when it is loaded.
+
+    anchors: href -> list of <a> elements with that href, in document order
+    headings: headings (h1 to h3) of the page body, in document order
+    heading_texts: text of each heading (by element id), including its number once numbered
+    """
+
+    def __init__(self, transformer):
+        self.transformer = transformer
+        self.anchors = {}
+        self.headings = []
+        self.headings_by_id = {}
+        self.heading_texts = {}
+
+    def add_anchor(self, anchor):
+        self.anchors.setdefault(anchor["href"], []).append(anchor)
+
+    def add_heading(self, heading):
+        self.headings.append(heading)
+        self.headings_by_id.setdefault(heading.get("id"), heading)
+        self.heading_texts[id(heading)] = heading.text
+
+    def find_anchor(self, href):
+        """First link to `href` still in the document (like `soup.find("a", href=href)`)"""
+        for anchor in self.anchors.get(href, ()):
+            if self.transformer.is_attached(anchor):
+                return anchor
+
+    def get_heading(self, heading_id):
+        heading = self.headings_by_id.get(heading_id)
+        if heading and self.transformer.is_attached(heading):
+            return heading
+
+    def get_headings(self):
+        """Headings still in the document"""
+        return [h for h in self.headings if self.transformer.is_attached(h)]
+
+    def get_heading_text(self, heading):
+        return self.heading_texts[id(heading)]
+
+    def set_heading_text(self, heading, text):
+        self.heading_texts[id(heading)] = text
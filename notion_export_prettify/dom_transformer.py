@@ -0,0 +1,58 @@
+class Rule:
+    """
+    A transformation of the document.
+
+    tags: names of the elements the rule is interested in
+    handle: called with each of those elements, in document order
+    end: called once, after all elements have been handled
+    """
+
+    def __init__(self, tags=(), handle=None, end=None):
+        self.tags = set(tags)
+        self.handle = handle
+        self.end = end
+
+
+class DomTransformer:
+    """
+    Applies a set of rules to a document with a single traversal of its tree.
+
+    Elements are first collected for all rules at once, then each rule is applied in turn,
+    so that rules behave as if they had been run one after the other.
+    Elements removed from the document by an earlier rule are skipped.
+    """
+
+    def __init__(self, soup):
+        self.soup = soup
+
+    def run(self, rules):
+        dispatch = {}
+        for rule in rules:
+            for tag in rule.tags:
+                dispatch.setdefault(tag, []).append(rule)
+
+        matches = {id(rule): [] for rule in rules}
+        if dispatch:
+            for element in self.soup.descendants:
+                # Text nodes have no name
+                for rule in dispatch.get(element.name, ()):
+                    matches[id(rule)].append(element)
+
+        for rule in rules:
+            if rule.handle:
+                for element in matches[id(rule)]:
+                    if self.is_attached(element):
+                        rule.handle(element)
+            if rule.end:
+                rule.end()
+
+    def is_attached(self, element):
+        """Whether the element is still part of the document"""
+        root = element
+        for root in element.parents:
+            pass
+        return root is self.soup
+
+
+def is_within(element, ancestor):
+    return any(parent is ancestor for parent in element.parents)
@@ -0,0 +1,18 @@
+class ConversionError(Exception):
+    """Base class of the errors raised by a conversion"""
+
+
+class InvalidOptionsError(ConversionError, ValueError):
+    """Unknown option, invalid value, or option not supported by this entry point"""
+
+
+class TemplateNotFoundError(InvalidOptionsError):
+    """No template folder or config file with this name or path"""
+
+
+class InvalidExportError(ConversionError, ValueError):
+    """The input is not a Notion export that can be converted (format, number of pages, structure)"""
+
+
+class RenderError(ConversionError):
+    """The browser failed to render a document"""
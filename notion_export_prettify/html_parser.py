@@ -0,0 +1,48 @@
+import functools
+import importlib
+import logging
+
+from bs4 import BeautifulSoup
+
+# Parsers in order of preference, for "auto". The first ones are C-accelerated
+PARSERS = ["lxml", "html5-parser", "html.parser"]
+
+# Python module each parser needs
+PARSER_MODULES = {"lxml": "lxml", "html5-parser": "html5_parser"}
+
+
+@functools.cache
+def is_available(parser):
+    module = PARSER_MODULES.get(parser)
+    if module is None:
+        return True
+    try:
+        importlib.import_module(module)
+        return True
+    except Exception as e:
+        # Not installed, or unusable (eg. html5-parser built against another libxml2 than lxml)
+        logging.debug("HTML parser '%s' is not available: %s", parser, e)
+        return False
+
+
+def available_parsers():
+    return [parser for parser in PARSERS if is_available(parser)]
+
+
+def resolve_parser(parser=None):
+    """The parser to use: the one requested if it is installed, otherwise the fastest one installed"""
+    if parser and parser != "auto":
+        if is_available(parser):
+            return parser
+        logging.warning("HTML parser '%s' is not available. Using the default one", parser)
+    return available_parsers()[0]
+
+
+def parse_html(content, parser=None):
+    """Parses a whole HTML document into a BeautifulSoup tree"""
+    parser = resolve_parser(parser)
+    if parser == "html5-parser":
+        from html5_parser import parse
+
+        return parse(content, treebuilder="soup", return_root=False)
+    return BeautifulSoup(content, parser)
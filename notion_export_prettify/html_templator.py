@@ -1,22 +1,39 @@
+import re
+
 from jinja2 import Template
-from bs4 import BeautifulSoup
+
+from .html_parser import parse_html
+
+HEAD_TAG = re.compile(r"<head\b[^>]*>", re.IGNORECASE)
 
 
 class HtmlTemplator:
-    def __init__(self, template):
-        self.html = template
+    """
+    template: the template source, or a compiled template (see `TemplateBundle.get_template`)
+    """
+
+    def __init__(self, template, parser=None):
+        self.template = template if isinstance(template, Template) else None
+        self.html = None if self.template else template
+        self.parser = parser
 
     def inject(self, context, **kwargs):
-        template = Template(self.html)
+        template = self.template or Template(self.html)
+        self.template = None
         self.html = template.render(context, **kwargs)
         return self
 
     def add_css(self, css):
-        soup = BeautifulSoup(self.html, "html.parser")
+        style_tag = f'<style type="text/css">{css}</style>'
+
+        # Insert the new <style> tag at the start of the <head>, without parsing the whole document
+        if head := HEAD_TAG.search(self.html):
+            self.html = self.html[: head.end()] + style_tag + self.html[head.end() :]
+            return self
+
+        soup = parse_html(self.html, self.parser)
         new_style_tag = soup.new_tag("style", type="text/css")
         new_style_tag.string = css
-
-        # Append the new <style> tag to the <head>
         soup.head.insert(0, new_style_tag)
         self.html = str(soup)
         return self
@@ -0,0 +1,182 @@
+import hashlib
+import logging
+import math
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from os import path
+from urllib.parse import unquote, urlparse
+
+import fitz  # PyMuPDF
+
+OPTIMIZED_FOLDER = "optimized-images"
+# Only those can be decoded and re-encoded safely (eg. no animated GIFs or SVGs)
+OPTIMIZABLE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+# CSS pixels are 1/96th of an inch
+CSS_DPI = 96
+# Number of images from which they are optimised in worker processes. Below it, starting the processes takes
+# longer than optimising the images in-process (about 0.1s per image, and 0.3s to start a pool)
+POOL_MIN_IMAGES = 8
+
+
+def default_cache_dir():
+    cache_home = os.environ.get("XDG_CACHE_HOME") or path.expanduser("~/.cache")
+    return path.join(cache_home, "notion-export-prettify")
+
+
+def _optimize_image(data, target_width, quality):
+    """
+    Resizes an image to the target width (if larger), and returns the new image as (bytes, extension),
+    or None if it can't be made smaller
+    """
+    is_jpeg = data[:3] == b"\xff\xd8\xff"
+    try:
+        pix = fitz.Pixmap(data)
+        if pix.width <= target_width:
+            return None
+
+        target_height = max(1, round(pix.height * target_width / pix.width))
+        if pix.colorspace and pix.colorspace.n > 3:
+            pix = fitz.Pixmap(fitz.csRGB, pix)
+        pix = fitz.Pixmap(pix, target_width, target_height)
+
+        # Only photos (already lossy) are re-encoded as JPEG. Screenshots stay lossless
+        if is_jpeg:
+            if pix.alpha:
+                pix = fitz.Pixmap(pix, 0)
+            optimized, extension = pix.tobytes("jpeg", jpg_quality=quality), ".jpg"
+        else:
+            optimized, extension = pix.tobytes("png"), ".png"
+    except Exception as e:
+        logging.debug("Could not optimise image: %s", e)
+        return None
+
+    if len(optimized) >= len(data):
+        return None
+    return optimized, extension
+
+
+class ImageOptimizer:
+    """
+    Downsamples the images of a document to the resolution they will be printed at.
+
+    dpi: target resolution of the printed images
+    print_width: width (in cm) of the printable area, which images can't be larger than
+    cache_dir: where to keep the optimised images between runs (keyed by content hash)
+    jobs: maximum number of worker processes, from POOL_MIN_IMAGES images on. Defaults to the number of CPUs
+    """
+
+    def __init__(
+        self, dpi=150, print_width=17, quality=85, cache_dir=None, jobs=None
+    ):
+        self.dpi = dpi
+        self.max_css_width = print_width / 2.54 * CSS_DPI
+        self.quality = quality
+        self.cache_dir = cache_dir
+        self.jobs = jobs
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get_target_width(self, img):
+        css_width = self.max_css_width
+        if match := re.search(r"width:\s*([\d.]+)px", img.get("style") or ""):
+            css_width = min(css_width, float(match.group(1)))
+        return math.ceil(css_width / CSS_DPI * self.dpi)
+
+    def optimize(self, soup, assets):
+        """
+        Optimises the images of the document, and points them to their new version.
+        Returns the optimised images, as a dict of {relative path: bytes}
+        """
+        images = {}
+        for img in soup.find_all("img", src=True):
+            url = urlparse(img["src"])
+            name = unquote(url.path)
+            if url.scheme or url.netloc or not name.lower().endswith(OPTIMIZABLE_EXTENSIONS):
+                continue
+            images.setdefault((name, self.get_target_width(img)), []).append(img)
+
+        tasks = {}
+        # Identical images can be used under several names
+        names = {}
+        for name, target_width in images:
+            data = assets.read(name) if assets else None
+            if data is None:
+                continue
+            key = hashlib.sha256(
+                data + f"|{target_width}|{self.quality}".encode()
+            ).hexdigest()
+            tasks[key] = (name, target_width, data)
+            names.setdefault(key, []).append((name, target_width))
+
+        results = self._load_cached(tasks.keys())
+        missing = [key for key in tasks if key not in results]
+        logging.debug(
+            "Optimising %s images (%s cached)", len(missing), len(tasks) - len(missing)
+        )
+        for key, result in zip(missing, self._run(tasks[key] for key in missing)):
+            results[key] = result
+            self._store_cached(key, result)
+
+        files = {}
+        for key, (name, target_width, data) in tasks.items():
+            if not results[key]:
+                continue
+            optimized, extension = results[key]
+            new_name = f"{OPTIMIZED_FOLDER}/{key[:32]}{extension}"
+            files[new_name] = optimized
+            for image in names[key]:
+                for img in images[image]:
+                    img["src"] = new_name
+            logging.debug(
+                "Image %s: %s -> %s bytes", name, len(data), len(optimized)
+            )
+        return files
+
+    def _run(self, tasks):
+        tasks = list(tasks)
+        arguments = (
+            [data for _, _, data in tasks],
+            [target_width for _, target_width, _ in tasks],
+            [self.quality] * len(tasks),
+        )
+        if not self.use_pool(len(tasks)):
+            return list(map(_optimize_image, *arguments))
+        # Spawned rather than forked, as this process may run other threads (server workers, browser loop threads)
+        with ProcessPoolExecutor(
+            max_workers=self.jobs, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            return list(pool.map(_optimize_image, *arguments))
+
+    def use_pool(self, image_count):
+        """Whether the images are worth optimising in worker processes"""
+        if image_count < POOL_MIN_IMAGES or self.jobs == 1 or (os.cpu_count() or 1) < 2:
+            return False
+        # Daemon processes (eg. pool workers) can't have children
+        return not multiprocessing.current_process().daemon
+
+    def _load_cached(self, keys):
+        results = {}
+        if not self.cache_dir:
+            return results
+        for key in keys:
+            for extension in (".jpg", ".png", ".skip"):
+                file_path = path.join(self.cache_dir, key + extension)
+                if path.exists(file_path):
+                    with open(file_path, "rb") as f:
+                        data = f.read()
+                    results[key] = (data, extension) if extension != ".skip" else None
+                    break
+        return results
+
+    def _store_cached(self, key, result):
+        if not self.cache_dir:
+            return
+        data, extension = result or (b"", ".skip")
+        # Written under a temporary name, so that concurrent runs never read partial files
+        file_path = path.join(self.cache_dir, key + extension)
+        with open(f"{file_path}.{os.getpid()}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{file_path}.{os.getpid()}.tmp", file_path)
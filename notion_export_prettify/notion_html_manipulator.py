@@ -1,21 +1,36 @@
+from os import path
+from urllib.parse import unquote, urlparse
+
 from bs4 import BeautifulSoup
 
+from .document_index import DocumentIndex
+from .dom_transformer import DomTransformer, Rule, is_within
+from .exceptions import InvalidExportError
+from .html_parser import parse_html
+
 
 class NotionHtmlManipulator:
-    def __init__(self, html_path):
+    def __init__(self, html_path, parser=None):
         with open(html_path, "r") as file:
             html_content = file.read()
-            self.soup = BeautifulSoup(html_content, "html.parser")
+            self.soup = parse_html(html_content, parser)
+            self.transformer = DomTransformer(self.soup)
+            self.heading_map = None
+            # Links and headings, for custom manipulations to look up without searching the document
+            self.index = DocumentIndex(self.transformer)
+            # <style> tags added to the document, by name, for them to be updated
+            self.style_tags = {}
 
             # Some essential parts of the Notion document structure
-            self.header = self.soup.find("header")
-            self.page_body = self.soup.find("div", class_="page-body")
-            self.toc = self.soup.find("nav")
+            self.header = None
+            self.page_body = None
+            self.toc = None
+            self.transformer.run([self.structure_rule()])
             self.title = str(self.get_title())
             self.description = str(self.get_description())
 
             if not self.page_body:
-                raise Exception(
+                raise InvalidExportError(
                     "Page body not found. This does not appear to be a valid Notion document"
                 )
 
@@ -24,16 +39,55 @@ class NotionHtmlManipulator:
             return self.title
 
         if self.header:
-            page_title = self.header.find("h1")
-            return page_title.text
+            return self._title.text
 
     def get_description(self):
         if hasattr(self, "description"):
             return self.description
 
         if self.header:
-            page_description = self.header.find("p", class_="page-description")
-            return page_description.text
+            return self._description.text
+
+    def apply(self, rules):
+        """Applies several rules to the document, in a single pass"""
+        # Any change to the document makes the heading map stale (unless rebuilt in the same pass)
+        self.heading_map = None
+        self.transformer.run(rules)
+
+    def structure_rule(self):
+        """Finds the header (with title and description), body and TOC of the document, and builds its index"""
+        self._title = None
+        self._description = None
+
+        def handle(element):
+            if element.name == "header":
+                self.header = self.header or element
+            elif element.name == "div":
+                if not self.page_body and "page-body" in element.get("class", []):
+                    self.page_body = element
+            elif element.name == "nav":
+                self.toc = self.toc or element
+            elif element.name == "a":
+                if element.get("href") is not None:
+                    self.index.add_anchor(element)
+
+            if element.name in ("h1", "h2", "h3"):
+                if self.page_body and is_within(element, self.page_body):
+                    self.index.add_heading(element)
+
+            if element.name == "h1":
+                if not self._title and self.header and is_within(element, self.header):
+                    self._title = element
+            elif element.name == "p":
+                if (
+                    not self._description
+                    and "page-description" in element.get("class", [])
+                    and self.header
+                    and is_within(element, self.header)
+                ):
+                    self._description = element
+
+        return Rule(["header", "div", "nav", "a", "h1", "h2", "h3", "p"], handle)
 
     def add_css_overwrites(self, css_content):
         # Create a new <style> tag
@@ -42,20 +96,35 @@ class NotionHtmlManipulator:
 
         # Append the new <style> tag to the <head>
         self.soup.head.append(new_style_tag)
+        return new_style_tag
 
     def remove_header(self):
-        for header in self.soup.find_all("header"):
-            header.extract()
+        self.apply([self.remove_header_rule()])
+
+    def remove_header_rule(self):
+        return Rule(["header"], lambda header: header.extract())
 
     def inject_title_block(self, title_block):
-        for header in self.soup.find_all("header"):
+        self.apply([self.title_block_rule(title_block)])
+
+    def title_block_rule(self, title_block):
+        def handle(header):
             header.clear()
-            title_block = BeautifulSoup(title_block, "html.parser")
-            header.append(title_block)
+            header.append(BeautifulSoup(title_block, "html.parser"))
+
+        return Rule(["header"], handle)
 
     def remove_internal_info(self):
+        self.apply([self.internal_info_rule()])
+
+    def internal_info_rule(self):
         # Remove all Internal callouts
-        for callout in self.page_body.find_all("figure", class_="callout"):
+        def handle(callout):
+            if "callout" not in callout.get("class", []) or not is_within(
+                callout, self.page_body
+            ):
+                return
+
             # But only if it contains a div with the string "Internal"
             for div in callout.find_all("div"):
                 if any(
@@ -65,15 +134,26 @@ class NotionHtmlManipulator:
                 ):
                     callout.extract()
 
+        return Rule(["figure"], handle)
+
     def remove_database_properties(self):
-        for header in self.soup.find_all("header"):
-            for table in header.find_all("table"):
+        self.apply([self.database_properties_rule()])
+
+    def database_properties_rule(self):
+        def handle(table):
+            if table.find_parent("header"):
                 table.extract()
 
+        return Rule(["table"], handle)
+
     def number_headings(self):
+        self.apply([self.heading_numbers_rule()])
+
+    def heading_numbers_rule(self):
         counters = [0, 0, 0]  # h1, h2, h3
+
         # Process all headings
-        for heading in self.page_body.find_all(["h1", "h2", "h3"]):
+        def handle(heading):
             level = int(heading.name[1]) - 1
             counters[level] += 1
             # Reset lower level counters
@@ -84,7 +164,7 @@ class NotionHtmlManipulator:
             numbering = ".".join(str(counters[i]) for i in range(level + 1)) + ". "
 
             # Add into a new span
-            heading_text = heading.text
+            heading_text = self.index.get_heading_text(heading)
             heading.clear()
 
             span_number = self.soup.new_tag("span")
@@ -97,20 +177,37 @@ class NotionHtmlManipulator:
 
             heading.append(span_number)
             heading.append(span_text)
+            self.index.set_heading_text(heading, numbering + heading_text)
 
             # Update TOC links if necessary
             # Assuming TOC anchors use the heading's id attribute
-            toc_link = self.soup.find("a", href=f'#{heading.get("id")}')
+            toc_link = self.index.find_anchor(f'#{heading.get("id")}')
             if toc_link:
                 toc_link.string = numbering + toc_link.text
 
+        def end():
+            for heading in self.index.get_headings():
+                handle(heading)
+
+        return Rule(end=end)
+
     def move_toc(self, keep=True):
+        self.apply([self.toc_rule(keep)])
+
+    def toc_rule(self, keep=True):
+        def end():
+            self._move_toc(keep)
+
+        return Rule(end=end)
+
+    def _move_toc(self, keep=True):
         # Move the TOC to the body
         if self.toc:
             # Find its ancestor that is a child of the body
             parent_to_remove = None
+            # NOTE: compared by identity, as == compares the whole content of the elements
             for parent in self.toc.parents:
-                if parent == self.page_body:
+                if parent is self.page_body:
                     break
                 parent_to_remove = parent
 
@@ -128,15 +225,71 @@ class NotionHtmlManipulator:
                 if parent_to_remove:
                     parent_to_remove.extract()
 
+    def outline_anchors_rule(self):
+        """
+        Adds hidden links to all headings.
+        Chromium only creates named destinations for link targets, and the PDF outline is built from them.
+        Without these, headings would be missing from the outline when the TOC is removed.
+        """
+
+        def end():
+            anchors = self.soup.new_tag("div", style="display: none")
+            anchors["class"] = "pdf-outline-anchors"
+            for heading in self.index.get_headings():
+                if heading.get("id"):
+                    anchors.append(self.soup.new_tag("a", href=f"#{heading['id']}"))
+            self.page_body.append(anchors)
+
+        return Rule(end=end)
+
+    def rewrite_page_links(self, base_dir, link_map: dict):
+        """
+        Points links to other pages of the export to new targets.
+        link_map: absolute path of the page's HTML file -> new href
+        """
+        for href, links in list(self.index.anchors.items()):
+            url = urlparse(href)
+            if url.scheme or url.netloc or not url.path.endswith(".html"):
+                continue
+
+            target = path.normpath(path.join(base_dir, unquote(url.path)))
+            if target in link_map:
+                for link in links:
+                    link["href"] = link_map[target]
+                    self.index.add_anchor(link)
+                del self.index.anchors[href]
+
+    def get_resource_urls(self):
+        """Paths of the local resources that are needed to render the document (images, videos, stylesheets...)"""
+        urls = set()
+        for tag in self.soup.find_all(True):
+            attributes = ["src", "poster"]
+            if tag.name == "link":
+                attributes.append("href")
+
+            for attribute in attributes:
+                url = urlparse(tag.get(attribute) or "")
+                if url.path and not url.scheme and not url.netloc:
+                    urls.add(unquote(url.path))
+        return urls
+
     def get_heading_map(self) -> dict:
-        # Extracts the id of all headings and maps them to their level
-        heading_map = {}
-        for heading in self.page_body.find_all(["h1", "h2", "h3"]):
-            heading_map[heading.get("id")] = dict(
-                level=int(heading.name[1]), text=heading.text
-            )
-
-        return heading_map
+        if self.heading_map is None:
+            self.apply([self.heading_map_rule()])
+        return self.heading_map
+
+    def heading_map_rule(self):
+        # Maps the id of all headings to their level and (numbered) text, from the index
+        def end():
+            self.heading_map = {
+                heading.get("id"): dict(
+                    level=int(heading.name[1]),
+                    text=self.index.get_heading_text(heading),
+                )
+                for heading in self.index.get_headings()
+            }
+
+        return Rule(end=end)
 
     def get_html(self):
         return str(self.soup)
@@ -1,97 +1,404 @@
+import asyncio
 import logging
+import os
+import threading
+import time
 from os import path
 
 import fitz  # PyMuPDF
-from playwright.sync_api import sync_playwright
+
+from .asset_server import ORIGIN, AssetServer
+from .browser_session import AsyncBrowserSession, BrowserSession
+from .document_chunks import stitch_documents
+from .profiler import count, profiled
+from .render_cache import RenderCache, file_digest
+from .resource_policy import ResourcePolicy
+from .underlay_renderer import PAGE_NUMBER_PLACEHOLDER, UnderlayRenderer
 
 empty_template = """
 <html><body></body></html>
 """
 
 
+# Opened background PDFs, reused across runs (eg. in batch or serve mode).
+# PyMuPDF documents must not be shared between threads, hence one cache per thread
+_backgrounds = threading.local()
+
+
+def open_background(pdf_path):
+    """Opens a background PDF, or returns the one already opened if the file hasn't changed"""
+    stat = os.stat(pdf_path)
+    real_path = path.realpath(pdf_path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+
+    # real path -> (stamp, document): a changed file replaces the document opened before
+    cache = getattr(_backgrounds, "documents", None)
+    if cache is None:
+        cache = _backgrounds.documents = {}
+    cached = cache.get(real_path)
+    if cached is None or cached[0] != stamp:
+        if cached is not None:
+            cached[1].close()
+        cached = cache[real_path] = (stamp, fitz.open(pdf_path))
+    return cached[1]
+
+
+# Options of each save profile: the final document merges several PDFs (main content, cover, underlays,
+# backgrounds), with unused objects and duplicated fonts that the larger profiles clean up
+SAVE_PROFILES = {
+    # Only drop unused objects: quickest, also used for intermediate files
+    "fast": dict(garbage=1),
+    # Smallest file: merge duplicated objects and fonts, compress everything, use object streams
+    "compact": dict(
+        garbage=4,
+        clean=True,
+        deflate=True,
+        deflate_images=True,
+        deflate_fonts=True,
+        use_objstms=True,
+        subset_fonts=True,
+    ),
+    # Compact, and linearised to display the first page while downloading (object streams can't be used)
+    "web": dict(
+        garbage=4,
+        clean=True,
+        deflate=True,
+        deflate_images=True,
+        deflate_fonts=True,
+        linear=True,
+        subset_fonts=True,
+    ),
+}
+
+
+class SharedBackground:
+    """
+    A background already drawn on a page (with `show_pdf_page`), to draw on other pages of the same size
+    and rotation by referencing the same form XObject, instead of creating a new one for each page.
+    """
+
+    def __init__(self, doc, page, xref):
+        self.doc = doc
+
+        # show_pdf_page wraps the imported page (xref) in a form XObject placed for the target page
+        self.form_xref = next(
+            form_xref
+            for form_xref, _, invoker, _ in page.get_xobjects()
+            if invoker == 0
+            and doc.xref_get_key(form_xref, "Resources/XObject/fullpage")[1]
+            == f"{xref} 0 R"
+        )
+        self.name = f"fzBg{self.form_xref}"
+
+        # Content stream drawing the background, shared by all pages
+        self.contents_xref = doc.get_new_xref()
+        doc.update_object(self.contents_xref, "<<>>")
+        doc.update_stream(self.contents_xref, f" q /{self.name} Do Q ".encode())
+
+    def draw_on(self, page):
+        # Add the form XObject to the page resources (following indirect objects)
+        target, key = page.xref, "Resources"
+        for next_key in ("XObject", self.name):
+            kind, value = self.doc.xref_get_key(target, key)
+            if kind == "xref":
+                target, key = int(value.split()[0]), next_key
+            else:
+                key = f"{key}/{next_key}"
+        self.doc.xref_set_key(target, key, f"{self.form_xref} 0 R")
+
+        # Draw it before the page content (as an underlay)
+        contents = [self.contents_xref] + page.get_contents()
+        self.doc.xref_set_key(
+            page.xref, "Contents", "[" + " ".join(f"{x} 0 R" for x in contents) + "]"
+        )
+
+
+async def render_html(
+    session: AsyncBrowserSession,
+    html,
+    temp_dir,
+    name,
+    in_memory=False,
+    assets=None,
+    resource_policy: ResourcePolicy = None,
+):
+    """
+    Renders HTML (whose relative resources are those of the export) with Playwright's async API,
+    and returns the PDF document as bytes
+    """
+    resource_policy = resource_policy or ResourcePolicy()
+    if in_memory:
+        server = AssetServer(html, assets, name=name)
+        url = server.url
+    else:
+        server = None
+        html_path = path.join(temp_dir, name)
+        with open(html_path, "w") as f:
+            f.write(html)
+        url = f"file://{html_path}"
+
+    async def render(page):
+        await resource_policy.attach_async(page)
+        if server:
+            await server.attach_async(page)
+        await page.goto(url, wait_until=resource_policy.wait_until)
+        return await page.pdf(display_header_footer=False, prefer_css_page_size=True)
+
+    return await session.run(render)
+
+
+def _describe(pdf_maker):
+    return dict(pages=len(pdf_maker.pdf_doc) if pdf_maker.pdf_doc else 0)
+
+
 class PdfMaker:
-    def __init__(self, temp_dir, output_name=None):
+    def __init__(
+        self,
+        temp_dir,
+        output_name=None,
+        session: BrowserSession = None,
+        in_memory=False,
+        cache: RenderCache = None,
+        resource_policy: ResourcePolicy = None,
+    ):
         self.pdf_doc = None
         self.temp_dir = temp_dir
+        # Shared browser, to avoid launching Chromium for every render
+        self.session = session or BrowserSession.default()
+        # Pass HTML and PDF documents around as bytes, instead of through temporary files
+        self.in_memory = in_memory
+        # Where to reuse the cover and underlays rendered by previous runs from
+        self.cache = cache
+        # How the documents load remote resources
+        self.resource_policy = resource_policy or ResourcePolicy()
         if output_name:
             self.output_path = path.join(temp_dir, output_name)
         else:
             self.output_path = path.join(temp_dir, "updated_doc.pdf")
 
+    @profiled("pdf.render", _describe)
     def from_html_file(self, html_input_path):
         """PlayWright - modern replacement for pyppeteer"""
-        with sync_playwright() as p:
-            browser = p.chromium.launch()
-            page = browser.new_page()
-
-            # Navigate to the page
-            page.goto(f"file://{html_input_path}")
-
-            # Add PDF-specific overwrites
-            # page.add_style_tag(
-            #     content="@page:first {margin-top: 0;} body {margin-top: 1cm;}"
-            # )
-
-            # NOTE: abandonned any attempt at making use of header_template and footer_template. Too inflexible
-            page.pdf(
-                path=self.output_path,
-                # format="A4",
-                display_header_footer=False,
-                prefer_css_page_size=True,
-                # margin=dict(top="0", right="0", bottom="0", left="0"),
-            )
+        self.session.run(lambda page: self._render(page, html_input_path))
+        self.pdf_doc = fitz.open(self.output_path)
+
+    def _render(self, page, html_input_path):
+        # Navigate to the page
+        self.resource_policy.attach(page)
+        page.goto(f"file://{html_input_path}", wait_until=self.resource_policy.wait_until)
 
-            self.pdf_doc = fitz.open(self.output_path)
+        # Add PDF-specific overwrites
+        # page.add_style_tag(
+        #     content="@page:first {margin-top: 0;} body {margin-top: 1cm;}"
+        # )
 
-            browser.close()
+        # NOTE: abandonned any attempt at making use of header_template and footer_template. Too inflexible
+        page.pdf(
+            path=self.output_path,
+            # format="A4",
+            display_header_footer=False,
+            prefer_css_page_size=True,
+            # margin=dict(top="0", right="0", bottom="0", left="0"),
+        )
+
+    def from_html(self, html_content, assets=None):
+        if self.in_memory:
+            return self.from_html_bytes(html_content, assets)
 
-    def from_html(self, html_content):
         file_path = path.join(self.temp_dir, "additional_html.html")
         with open(file_path, "w") as f:
             f.write(html_content)
         return self.from_html_file(file_path)
 
+    @profiled("pdf.render", _describe)
+    def from_html_bytes(self, html_content, assets=None):
+        """Renders HTML from memory, with its resources served from `assets` (if any)"""
+        server = AssetServer(html_content, assets)
+        pdf_bytes = self.session.run(lambda page: self._render_bytes(page, server))
+        self.pdf_doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+
+    def _render_bytes(self, page, server: AssetServer):
+        self.resource_policy.attach(page)
+        server.attach(page)
+        page.goto(server.url, wait_until=self.resource_policy.wait_until)
+        return page.pdf(display_header_footer=False, prefer_css_page_size=True)
+
+    @profiled("pdf.render_chunks", _describe)
+    def from_html_chunks(self, chunks, assets=None):
+        """
+        Renders the chunks of a document (see DocumentSplitter) concurrently, each in its own page of the
+        async browser of the session (see BrowserSession.run_async), and stitches them together
+        """
+
+        async def render_all(session):
+            return await asyncio.gather(
+                *(
+                    render_html(
+                        session,
+                        chunk,
+                        self.temp_dir,
+                        f"chunk_{i}.html",
+                        self.in_memory,
+                        assets,
+                        self.resource_policy,
+                    )
+                    for i, chunk in enumerate(chunks)
+                )
+            )
+
+        pdfs = self.session.run_async(render_all)
+        docs = [fitz.open(stream=pdf_bytes, filetype="pdf") for pdf_bytes in pdfs]
+        self.pdf_doc = stitch_documents(docs)
+
+    def _make_child(self, output_name):
+        return PdfMaker(
+            temp_dir=self.temp_dir,
+            output_name=output_name,
+            session=self.session,
+            in_memory=self.in_memory,
+            cache=self.cache,
+            resource_policy=self.resource_policy,
+        )
+
+    @profiled("pdf.merge_underlay", _describe)
     def merge_underlay_html(self, underlay_html):
+        underlays, missing = self.get_underlays(underlay_html)
+        if missing:
+            underlay_pdf = self._make_child("underlay.pdf")
+            underlay_pdf.from_html(self.get_underlay_document(underlay_html, missing))
+            if not self.add_underlays(underlay_html, underlays, missing, underlay_pdf.pdf_doc):
+                return self.merge_underlay_html_per_page(underlay_html)
+        self.merge_underlays(underlays)
+
+    def get_underlays(self, underlay_html):
+        """
+        The underlay of each page, as (document, page number), taken from the cache when possible,
+        and the indexes of the pages whose underlay is missing.
+        The underlays of a document are cached together, as a single PDF: pages drawn from the same document
+        share its fonts and images
+        """
+        underlays = [None] * len(self.pdf_doc)
+        if self.cache:
+            cached = self.cache.get_pdf(self._underlay_key(underlay_html))
+            if cached and len(cached) == len(self.pdf_doc):
+                underlays = [(cached, pno) for pno in range(len(cached))]
+        missing = [i for i, underlay in enumerate(underlays) if underlay is None]
+        logging.debug(
+            "Rendering %s underlays (%s cached)", len(missing), len(underlays) - len(missing)
+        )
+        return underlays, missing
+
+    def get_underlay_document(self, underlay_html, missing):
+        """All missing underlays, as a multi-page HTML document with one page per page number"""
+        page_sizes = [
+            (self.pdf_doc[i].rect.width, self.pdf_doc[i].rect.height) for i in missing
+        ]
+        return UnderlayRenderer(underlay_html).get_html(
+            page_sizes, [i + 1 for i in missing]
+        )
+
+    def add_underlays(self, underlay_html, underlays, missing, underlay_doc):
+        """Adds the missing underlays, as rendered. Returns False if they were not rendered as expected"""
+        if len(underlay_doc) != len(missing):
+            logging.warning(
+                "Underlay has %s pages instead of %s. Rendering each page separately",
+                len(underlay_doc),
+                len(missing),
+            )
+            return False
+
+        for pno, i in enumerate(missing):
+            underlays[i] = (underlay_doc, pno)
+        # Underlays are either all cached or all missing
+        if self.cache and len(missing) == len(self.pdf_doc):
+            self.cache.put_pdf(self._underlay_key(underlay_html), underlay_doc)
+        return True
+
+    def merge_underlays(self, underlays):
+        for page, (underlay_doc, pno) in zip(self.pdf_doc, underlays):
+            # NOTE: there's an apparent bug in PyMuPDF when using overlay=True:
+            #  dimensions of the overlay are 4x reduced and it is mirrored in both directions
+            page.show_pdf_page(page.rect, underlay_doc, pno=pno, overlay=False)
+
+    def _underlay_key(self, underlay_html):
+        """Key of the underlays of the document: the template, and the size of each page"""
+        page_sizes = "|".join(f"{page.rect.width}x{page.rect.height}" for page in self.pdf_doc)
+        return self.cache.make_key("underlays", underlay_html, page_sizes)
+
+    def merge_underlay_html_per_page(self, underlay_html):
         for i, page in enumerate(self.pdf_doc):
             logging.debug("Making underlay for page %s", i)
 
             # replace the page number in the html
             page_underlay_html = underlay_html
             page_underlay_html = page_underlay_html.replace(
-                "__PAGENUMBER__", str(i + 1)
-            )
-            underlay_pdf = PdfMaker(
-                temp_dir=self.temp_dir, output_name=f"underlay_{i}.pdf"
+                PAGE_NUMBER_PLACEHOLDER, str(i + 1)
             )
+            underlay_pdf = self._make_child(f"underlay_{i}.pdf")
             underlay_pdf.from_html(page_underlay_html)
 
-            # NOTE: there's an apparent bug in PyMuPDF when using overlay=True:
-            #  dimensions of the overlay are 4x reduced and it is mirrored in both directions
             page.show_pdf_page(page.rect, underlay_pdf.pdf_doc, pno=0, overlay=False)
 
+    @profiled("pdf.merge_background", _describe)
     def merge_background_pdf(
         self,
         background_pdf_path,
     ):
-        background = fitz.open(background_pdf_path)
+        background = open_background(background_pdf_path)
 
+        # The background is imported once, as a form XObject that all pages of the same size draw
+        shared_backgrounds = {}
         for page in self.pdf_doc:
-            page.show_pdf_page(page.rect, background, overlay=False)
+            key = (tuple(page.rect), page.rotation)
+            if key in shared_backgrounds:
+                shared_backgrounds[key].draw_on(page)
+            else:
+                xref = page.show_pdf_page(page.rect, background, overlay=False)
+                shared_backgrounds[key] = SharedBackground(self.pdf_doc, page, xref)
+
+        logging.debug(
+            "Background merged on %s pages, with %s form XObject(s)",
+            len(self.pdf_doc),
+            len(shared_backgrounds),
+        )
 
+    @profiled("pdf.prepend_cover", _describe)
     def prepend_cover_page(self, cover_pdf_path, additional_html):
-        final_cover_pdf_path = cover_pdf_path
         if additional_html:
-            title_pdf_make = PdfMaker(
-                temp_dir=self.temp_dir, output_name="titlepage.pdf"
+            titlepage = self.get_cached_cover_page(cover_pdf_path, additional_html)
+            if titlepage is None:
+                title_pdf_make = self._make_child("titlepage.pdf")
+                title_pdf_make.from_html(additional_html)
+                titlepage = self.finish_cover_page(
+                    title_pdf_make, cover_pdf_path, additional_html
+                )
+        else:
+            titlepage = open_background(cover_pdf_path)
+        self.insert_cover_page(titlepage)
+
+    def get_cached_cover_page(self, cover_pdf_path, additional_html):
+        if self.cache:
+            titlepage = self.cache.get_pdf(self._cover_key(cover_pdf_path, additional_html))
+            if titlepage:
+                logging.debug("Cover page taken from the render cache")
+            return titlepage
+
+    def finish_cover_page(self, title_pdf_make, cover_pdf_path, additional_html):
+        """Adds the cover PDF to the rendered title page, and returns it"""
+        if cover_pdf_path:
+            title_pdf_make.merge_background_pdf(cover_pdf_path)
+        if self.cache:
+            self.cache.put_pdf(
+                self._cover_key(cover_pdf_path, additional_html), title_pdf_make.pdf_doc
             )
-            title_pdf_make.from_html(additional_html)
-            if cover_pdf_path:
-                title_pdf_make.merge_background_pdf(cover_pdf_path)
+        return title_pdf_make.pdf_doc
 
-            final_cover_pdf_path = path.join(self.temp_dir, "final_title_page.pdf")
-            title_pdf_make.save(final_cover_pdf_path)
+    def _cover_key(self, cover_pdf_path, additional_html):
+        return self.cache.make_key(
+            "cover", additional_html, file_digest(cover_pdf_path) if cover_pdf_path else ""
+        )
 
-        titlepage = fitz.open(final_cover_pdf_path)
+    def insert_cover_page(self, titlepage):
         # Insert first page at the beginning of the document
         self.pdf_doc.insert_pdf(titlepage, start_at=0)
 
@@ -101,6 +408,7 @@ class PdfMaker:
             labels[0]["style"] = ""
             self.pdf_doc.set_page_labels(labels)
 
+    @profiled("pdf.set_metadata")
     def set_metadata(self, new_metadata: dict):
         """
         metadata: dict
@@ -110,56 +418,95 @@ class PdfMaker:
         metadata.update(new_metadata)
         self.pdf_doc.set_metadata(metadata)
 
+    @profiled("pdf.make_toc", _describe)
     def make_toc(self, heading_map: dict):
         # Create a PDF table of contents, from headings
-        toc = []
+        self.remove_stale_links()
+        toc = self.build_outline(heading_map)
 
-        for page_number, page in enumerate(self.pdf_doc):
-            logging.debug(f"Searching for links on page {page_number}")
-            links = page.get_links()
+        try:
+            self.pdf_doc.set_toc(toc)
+        except Exception as e:
+            logging.error(f"Error setting TOC: {e}")
 
-            for link in links:
-                # get the text of the link (just because...)
-                rect = fitz.Rect(link["from"])
-                text = page.get_text(clip=rect)
+    def build_outline(self, heading_map: dict):
+        """
+        Resolves the headings (in document order) against the named destinations of the document.
+        heading_map: heading id -> dict(level, text)
+        """
+        destinations = self.pdf_doc.resolve_names()
+        if heading_map and not destinations:
+            logging.warning("No named destinations found. Building the TOC from links")
+            destinations = self.get_link_destinations()
+
+        toc = []
+        for heading_id, heading in heading_map.items():
+            destination = destinations.get(heading_id)
+            if not destination or destination.get("page", -1) < 0:
+                logging.debug(f"No destination for heading #{heading_id}")
+                continue
+
+            # 0-based page numbers in destinations; 1-based in TOC
+            toc.append([heading["level"], heading["text"], destination["page"] + 1])
+        return toc
 
+    def get_link_destinations(self):
+        """Named destinations, as found in the internal links of the document"""
+        destinations = {}
+        for page in self.pdf_doc:
+            for link in page.get_links():
                 if link["kind"] == fitz.LINK_NAMED:
-                    tgt_page_number = link["page"]
-                    tgt_id = link["nameddest"]
-
-                    # add an entry to the table of contents
-                    heading = heading_map.get(tgt_id)
-                    if heading:
-                        toc.append(
-                            [heading["level"], heading["text"], tgt_page_number + 1]
-                        )  # 0-based page numbers in links; 1-based in TOC
-
-                    logging.debug(
-                        f"link '{heading['text']}' to #{tgt_id} -> page {tgt_page_number}"
-                    )
-                elif link["kind"] == fitz.LINK_URI:
-                    logging.debug(f"link '{text}' -> uri {link.get('uri')}")
-                elif link["kind"] == fitz.LINK_LAUNCH:
+                    destinations.setdefault(link["nameddest"], dict(page=link["page"]))
+        return destinations
+
+    def remove_stale_links(self):
+        for page in self.pdf_doc:
+            for link in page.get_links():
+                if link["kind"] == fitz.LINK_LAUNCH:
                     logging.debug(f"deleting link -> file {link.get('file')}")
-                    # LINK_LAUNCH links for images are not useful anymore as they point to the tempdir. 
+                    # LINK_LAUNCH links for images are not useful anymore as they point to the tempdir.
+                    page.delete_link(link)
+                elif link["kind"] == fitz.LINK_URI and link.get("uri", "").startswith(
+                    ORIGIN
+                ):
+                    logging.debug(f"deleting link -> resource {link.get('uri')}")
+                    # Same as LINK_LAUNCH, for documents rendered from memory
                     page.delete_link(link)
-                else:
-                    logging.debug(f"link of type {link['kind']} with text '{text}'")
 
+    @profiled("pdf.save", _describe)
+    def save(self, output_pdf_path=None, profile="fast"):
+        """Saves the document with the options of a save profile. Returns the file size, in bytes"""
+        if not output_pdf_path:
+            output_pdf_path = self.output_path
+        options = dict(SAVE_PROFILES[profile])
+        started_at = time.perf_counter()
+
+        if options.pop("subset_fonts", False):
+            self.subset_fonts()
         try:
-            # remove duplicates
-            final_toc = []
-            last_row = None
-            for row in toc:
-                if row != last_row:
-                    final_toc.append(row)
-                    last_row = row
-            
-            self.pdf_doc.set_toc(final_toc)
+            self.pdf_doc.save(output_pdf_path, **options)
         except Exception as e:
-            logging.error(f"Error setting TOC: {e}")
+            if not options.pop("linear", False):
+                raise
+            # Recent MuPDF versions dropped linearisation: save it compact instead
+            logging.warning(f"Could not linearise the PDF ({e}). Using object streams instead")
+            self.pdf_doc.save(output_pdf_path, **options, use_objstms=True)
 
-    def save(self, output_pdf_path=None):
-        if not output_pdf_path:
-            output_pdf_path = self.output_path
-        self.pdf_doc.save(output_pdf_path)
+        size = path.getsize(output_pdf_path)
+        count("bytes_written", size)
+        logging.debug(
+            "Saved %s with profile '%s': %s bytes in %.2fs",
+            output_pdf_path,
+            profile,
+            size,
+            time.perf_counter() - started_at,
+        )
+        return size
+
+    def subset_fonts(self):
+        """Keeps only the glyphs used from each embedded font (which also merges duplicated subsets)"""
+        try:
+            self.pdf_doc.subset_fonts()
+        except Exception as e:
+            # Older PyMuPDF versions need fontTools for this
+            logging.warning(f"Could not subset fonts: {e}")
@@ -0,0 +1,263 @@
+import asyncio
+import contextvars
+import functools
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import fitz  # PyMuPDF
+
+from .browser_session import AsyncBrowserSession
+from .converter import Converter
+from .document_chunks import stitch_documents
+from .pdf_maker import PdfMaker, render_html
+from .print_color import green, is_quiet, orange, set_quiet
+from .profiler import get_profiler, stage, use_profiler
+from .underlay_renderer import PAGE_NUMBER_PLACEHOLDER
+
+# Maximum number of underlay pages rendered at once, when rendered one by one
+MAX_UNDERLAY_RENDERS = 4
+
+
+class StageGraph:
+    """
+    Stages of a pipeline, with the stages each of them depends on.
+    Each stage starts as soon as those are done, so that independent stages run concurrently.
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name, function, *dependencies):
+        """function: coroutine function, called without arguments"""
+        self.stages[name] = (function, dependencies)
+
+    async def run(self):
+        """Runs all stages, and returns their results by name"""
+
+        async def run_stage(name):
+            function, dependencies = self.stages[name]
+            await asyncio.gather(*(tasks[dependency] for dependency in dependencies))
+            with stage(name):
+                return await function()
+
+        tasks = {name: asyncio.ensure_future(run_stage(name)) for name in self.stages}
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        return {name: task.result() for name, task in tasks.items()}
+
+
+class Pipeline:
+    """
+    Runs the stages of a conversion as a graph, for the renders of the main document and of the cover to overlap:
+
+        extract -> manipulate -> render_main -> underlay -> background -> cover -> finish
+                            \\-> render_cover --------------------------------/
+
+    The underlay depends on the main document, as it needs its number and size of pages.
+    With --render-chunks, the chunks of the main document are rendered concurrently too.
+    Renders run concurrently in one browser, with Playwright's async API. Document work (parsing, templating,
+    PyMuPDF merges) runs in a worker thread while renders are in progress: a single one, as PyMuPDF is not
+    thread-safe.
+    """
+
+    def __init__(self, converter: Converter, session: AsyncBrowserSession):
+        self.converter = converter
+        self.args = converter.args
+        self.session = session
+        # The worker prints as the thread running the pipeline would
+        self.executor = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="pipeline",
+            initializer=set_quiet,
+            initargs=(is_quiet(),),
+        )
+        self.temp_dir = None
+
+        # Results of the stages
+        self.html_file = None
+        self.manipulator = None
+        self.pdf_maker = None
+        self.titlepage = None
+        self.output_file = None
+
+    async def run(self, output_file=None):
+        """Converts the input file, and returns the path of the PDF file generated"""
+        converter = self.converter
+        if converter.cache_output:
+            converter.output_cache_key = converter.get_output_cache_key()
+            if cached_output := converter.load_cached_output(output_file):
+                return cached_output
+
+        graph = StageGraph()
+        graph.add("extract", self.extract)
+        graph.add("manipulate", self.manipulate, "extract")
+        graph.add("render_main", self.render_main, "manipulate")
+        graph.add("render_cover", self.render_cover, "manipulate")
+        graph.add("underlay", self.underlay, "render_main")
+        graph.add("background", self.background, "underlay")
+        graph.add("cover", self.cover, "background", "render_cover")
+        graph.add("finish", functools.partial(self.finish, output_file), "cover")
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.temp_dir = temp_dir
+            try:
+                with stage("convert"):
+                    await graph.run()
+            finally:
+                converter.close_input()
+                self.executor.shutdown()
+        return self.output_file
+
+    async def in_worker(self, function, *args, **kwargs):
+        # The worker records its stages to the profiler of the pipeline, nested in the stage calling it
+        profiler = get_profiler()
+        context = contextvars.copy_context()
+
+        def run():
+            with use_profiler(profiler):
+                return function(*args, **kwargs)
+
+        return await asyncio.get_running_loop().run_in_executor(self.executor, context.run, run)
+
+    def new_pdf_maker(self):
+        return PdfMaker(
+            temp_dir=self.temp_dir,
+            in_memory=self.args.in_memory,
+            cache=self.converter.cache,
+            resource_policy=self.converter.resource_policy,
+        )
+
+    async def render(self, html, name):
+        """Renders HTML (whose relative resources are those of the export), and returns its PdfMaker"""
+        pdf_bytes = await render_html(
+            self.session,
+            html,
+            self.temp_dir,
+            name,
+            self.args.in_memory,
+            self.converter.assets,
+            self.converter.resource_policy,
+        )
+        pdf_maker = self.new_pdf_maker()
+        pdf_maker.pdf_doc = await self.in_worker(fitz.open, stream=pdf_bytes, filetype="pdf")
+        return pdf_maker
+
+    async def extract(self):
+        self.html_file = await self.in_worker(self.converter.extract_input, self.temp_dir)
+
+    async def manipulate(self):
+        converter = self.converter
+        self.manipulator = await self.in_worker(converter.manipulate_html, self.html_file)
+
+        if self.args.optimize_images:
+            green("[PROC] Optimising images")
+            await self.in_worker(converter.optimize_images, self.manipulator, self.temp_dir)
+        else:
+            orange("[SKIP] Images kept as original")
+
+        if converter.zip_ref and not self.args.in_memory:
+            await self.in_worker(
+                converter.extract_resources,
+                self.manipulator.get_resource_urls(),
+                self.temp_dir,
+            )
+
+    async def render_main(self):
+        green("[PROC] Generating main PDF document")
+        if chunks := await self.in_worker(self.converter.get_chunks, self.manipulator):
+            chunk_makers = await asyncio.gather(
+                *(self.render(chunk, f"chunk_{i}.html") for i, chunk in enumerate(chunks))
+            )
+            self.pdf_maker = self.new_pdf_maker()
+            self.pdf_maker.pdf_doc = await self.in_worker(
+                stitch_documents, [chunk_maker.pdf_doc for chunk_maker in chunk_makers]
+            )
+            return
+
+        html = await self.in_worker(self.manipulator.get_html)
+        self.pdf_maker = await self.render(html, "updated_doc.html")
+
+    async def render_cover(self):
+        if not self.converter.with_cover_page:
+            return
+
+        cover_page_file, cover_html = await self.in_worker(self.converter.get_cover_page)
+        cover_maker = self.new_pdf_maker()
+        self.titlepage = await self.in_worker(
+            cover_maker.get_cached_cover_page, cover_page_file, cover_html
+        )
+        if self.titlepage is None:
+            title_pdf_make = await self.render(cover_html, "titlepage.html")
+            self.titlepage = await self.in_worker(
+                cover_maker.finish_cover_page, title_pdf_make, cover_page_file, cover_html
+            )
+
+    async def underlay(self):
+        pdf_maker = self.pdf_maker
+        underlay_html = await self.in_worker(self.converter.get_underlay_html)
+        if not underlay_html:
+            return
+
+        underlays, missing = await self.in_worker(pdf_maker.get_underlays, underlay_html)
+        if missing:
+            document = await self.in_worker(
+                pdf_maker.get_underlay_document, underlay_html, missing
+            )
+            underlay_pdf = await self.render(document, "underlay.html")
+            if not await self.in_worker(
+                pdf_maker.add_underlays, underlay_html, underlays, missing, underlay_pdf.pdf_doc
+            ):
+                # Each page rendered separately, a few at a time (documents can have hundreds of pages)
+                page_count = await self.in_worker(len, pdf_maker.pdf_doc)
+                semaphore = asyncio.Semaphore(MAX_UNDERLAY_RENDERS)
+
+                async def render_page(i):
+                    async with semaphore:
+                        return await self.render(
+                            underlay_html.replace(PAGE_NUMBER_PLACEHOLDER, str(i + 1)),
+                            f"underlay_{i}.html",
+                        )
+
+                underlay_pdfs = await asyncio.gather(*(render_page(i) for i in range(page_count)))
+                underlays = [(underlay_pdf.pdf_doc, 0) for underlay_pdf in underlay_pdfs]
+
+        await self.in_worker(pdf_maker.merge_underlays, underlays)
+
+    async def background(self):
+        await self.in_worker(self.converter.add_background, self.pdf_maker)
+
+    async def cover(self):
+        if self.titlepage is None:
+            orange("[SKIP] Skipping cover page")
+            return
+        green("[PROC] Prefixing with cover page")
+        await self.in_worker(self.pdf_maker.insert_cover_page, self.titlepage)
+
+    async def finish(self, output_file):
+        converter = self.converter
+
+        def finish():
+            # 3. - Add PDF TOC
+            green("[PROC] Building PDF TOC")
+            self.pdf_maker.make_toc(self.manipulator.get_heading_map())
+
+            converter.add_metadata(self.pdf_maker)
+            return converter.save(self.pdf_maker, output_file)
+
+        self.output_file = await self.in_worker(finish)
+
+
+def convert(converter: Converter, output_file=None):
+    """
+    Runs the conversion with the concurrent pipeline, and returns the path of the PDF file generated.
+    It runs on the loop thread of the converter's browser session, with the async browser it keeps (see
+    BrowserSession.run_async), so that the thread of the session can also render with its sync API
+    """
+    return converter.session.run_async(
+        lambda session: Pipeline(converter, session).run(output_file)
+    )
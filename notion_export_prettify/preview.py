@@ -0,0 +1,154 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from os import path
+
+import fitz  # PyMuPDF
+
+# Perspective of the pages in the strip: their left edge is moved right, and shortened at the top and bottom
+# (as fractions of the page width and height)
+STRIP_LEFT = 0.1
+STRIP_TOP = 0.075
+STRIP_BOTTOM = 0.05
+# Part of each page hidden by the one on its left
+STRIP_OVERLAP = 1 / 6
+# Columns each page is drawn in, to approximate the perspective
+STRIP_SLICES = 48
+# Number of pages from which they are rendered in worker processes. Below it, starting the processes takes longer
+# than rendering the pages in-process
+POOL_MIN_PAGES = 16
+
+
+def _render_thumbnail(pdf_bytes, page_number, zoom, border):
+    """Renders a page, framed by a black border, as PNG bytes"""
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    pix = doc[page_number].get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    if not border:
+        return pix.tobytes("png")
+
+    framed = fitz.Pixmap(
+        fitz.csRGB, fitz.IRect(0, 0, pix.width + 2 * border, pix.height + 2 * border), False
+    )
+    framed.clear_with(0)
+    pix.set_origin(border, border)
+    framed.copy(pix, pix.irect)
+    return framed.tobytes("png")
+
+
+def make_strip(thumbnails):
+    """
+    The thumbnails side by side in perspective, running left to right with the left-most one on top,
+    on a transparent background (as PNG bytes).
+    Each thumbnail is drawn in columns, narrower and shorter towards its left edge.
+    """
+    pixmaps = [fitz.Pixmap(data) for data in thumbnails]
+    width = max(pix.width for pix in pixmaps)
+    height = max(pix.height for pix in pixmaps)
+    step = round(width * (1 - STRIP_OVERLAP))
+    strip = fitz.Pixmap(
+        fitz.csRGB, fitz.IRect(0, 0, step * (len(pixmaps) - 1) + width, height), True
+    )
+    strip.clear_with()
+
+    # Drawn from the right, for the pages on the left to be on top
+    for i in reversed(range(len(pixmaps))):
+        pix = pixmaps[i]
+        x0 = i * step
+        for s in range(STRIP_SLICES):
+            u0, u1 = s / STRIP_SLICES, (s + 1) / STRIP_SLICES
+            u = (u0 + u1) / 2
+            left = x0 + round(pix.width * (STRIP_LEFT + (1 - STRIP_LEFT) * u0))
+            right = x0 + round(pix.width * (STRIP_LEFT + (1 - STRIP_LEFT) * u1))
+            top = round(pix.height * STRIP_TOP * (1 - u))
+            bottom = round(pix.height * (1 - STRIP_BOTTOM * (1 - u)))
+            column = fitz.IRect(round(pix.width * u0), 0, round(pix.width * u1), pix.height)
+            if right <= left or column.is_empty:
+                continue
+
+            column = fitz.Pixmap(fitz.Pixmap(pix, pix.width, pix.height, column), 1)
+            column = fitz.Pixmap(column, right - left, bottom - top, None)
+            column.set_origin(left, top)
+            strip.copy(column, column.irect)
+    return strip.tobytes("png")
+
+
+class PreviewMaker:
+    """
+    Rasterises the first pages of a document into thumbnails, and into a strip showing them in perspective.
+    Pages are rendered in-process, without temporary files. From POOL_MIN_PAGES pages on, they are rendered in
+    parallel in worker processes (as PyMuPDF is not thread-safe), which are spawned rather than forked, as the
+    process forking them may run other threads (eg. a browser session's loop thread).
+
+    pages: number of pages previewed (from the first one)
+    dpi: resolution of the previews
+    max_size: maximum width and height of each page (in pixels, without its border). Pages larger than that
+        at `dpi` are rendered at a lower resolution
+    border: width of the black border around each page (in pixels)
+    jobs: maximum number of worker processes. Defaults to the number of CPUs
+    """
+
+    def __init__(self, pages=4, dpi=100, max_size=600, border=3, jobs=None):
+        self.pages = pages
+        self.dpi = dpi
+        self.max_size = max_size
+        self.border = border
+        self.jobs = jobs
+
+    def get_zoom(self, doc):
+        rect = doc[0].rect
+        zoom = self.dpi / 72
+        if self.max_size:
+            zoom = min(zoom, self.max_size / max(rect.width, rect.height))
+        return zoom
+
+    def make_previews(self, doc, thumbnails=True, strip=True):
+        """Returns the thumbnails (as a list) and the strip of the document, as PNG bytes"""
+        page_count = min(self.pages, len(doc))
+        if not page_count:
+            return [], None
+
+        # Only the pages previewed are sent to the workers
+        preview_doc = fitz.open()
+        preview_doc.insert_pdf(doc, from_page=0, to_page=page_count - 1, links=False, annots=False)
+        zoom = self.get_zoom(preview_doc)
+        logging.debug("Rendering %s previews at zoom %.2f", page_count, zoom)
+
+        images = self._render(preview_doc.tobytes(), page_count, zoom)
+        return (images if thumbnails else []), (make_strip(images) if strip else None)
+
+    @staticmethod
+    def write_previews(thumbnails, strip, output_dir, name):
+        """Writes `name`-page-N.png and `name`-strip.png to the output folder, and returns their paths"""
+        os.makedirs(output_dir, exist_ok=True)
+        files = {
+            path.join(output_dir, f"{name}-page-{i + 1}.png"): data
+            for i, data in enumerate(thumbnails)
+        }
+        if strip:
+            files[path.join(output_dir, f"{name}-strip.png")] = strip
+        for file_path, data in files.items():
+            with open(file_path, "wb") as f:
+                f.write(data)
+        return list(files)
+
+    def _render(self, pdf_bytes, page_count, zoom):
+        arguments = (
+            [pdf_bytes] * page_count,
+            range(page_count),
+            [zoom] * page_count,
+            [self.border] * page_count,
+        )
+        if not self.use_pool(page_count):
+            return list(map(_render_thumbnail, *arguments))
+        with ProcessPoolExecutor(
+            max_workers=self.jobs, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            return list(pool.map(_render_thumbnail, *arguments))
+
+    def use_pool(self, page_count):
+        """Whether the pages are worth rendering in worker processes"""
+        if page_count < POOL_MIN_PAGES or self.jobs == 1 or (os.cpu_count() or 1) < 2:
+            return False
+        # Daemon processes (eg. pool workers) can't have children
+        return not multiprocessing.current_process().daemon
@@ -1,23 +1,53 @@
+import threading
+from contextlib import contextmanager
+
 # Initialize Colorama (necessary on Windows)
 from colorama import init
 from colorama import Fore, Style
 
+_local = threading.local()
+
+
+def is_quiet():
+    return getattr(_local, "quiet", False)
+
+
+def set_quiet(value):
+    """Silences (or not) the messages printed by the current thread"""
+    _local.quiet = value
+
+
+@contextmanager
+def quiet():
+    """Silences the messages printed by the current thread in the block (eg. when converting through the API)"""
+    previous = is_quiet()
+    set_quiet(True)
+    try:
+        yield
+    finally:
+        set_quiet(previous)
+
+
+def _print(text):
+    if not is_quiet():
+        print(text)
+
 
 # Define wrapper functions for each color
 def red(text):
-    print(f"{Fore.RED}{text}{Style.RESET_ALL}")
+    _print(f"{Fore.RED}{text}{Style.RESET_ALL}")
 
 
 def green(text):
-    print(f"{Fore.GREEN}{text}{Style.RESET_ALL}")
+    _print(f"{Fore.GREEN}{text}{Style.RESET_ALL}")
 
 
 def blue(text):
-    print(f"{Fore.BLUE}{text}{Style.RESET_ALL}")
+    _print(f"{Fore.BLUE}{text}{Style.RESET_ALL}")
 
 
 def orange(text):
-    print(rgb(255, 165, 0, text))
+    _print(rgb(255, 165, 0, text))
 
 
 def rgb(r, g, b, text):
@@ -0,0 +1,180 @@
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+_local = threading.local()
+# Depth of the stage being recorded. A context variable, for stages running concurrently (in asyncio tasks or
+# worker threads) to each be nested in the stage that started them
+_depth = contextvars.ContextVar("profiler_depth", default=0)
+
+
+def get_peak_rss():
+    """Peak resident memory of the process so far, in MB (None if unknown)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # In bytes on macOS, in KB elsewhere
+    return round(peak / (1024**2 if sys.platform == "darwin" else 1024), 1)
+
+
+class Profiler:
+    """
+    Records the wall time, CPU time and peak memory of each stage of a conversion, and counters
+    (eg. browser launches, bytes written). Cheap enough to be always on: a few system calls per stage.
+
+    Only the current process is measured: the CPU and memory used by Chromium are not included.
+    Stages and counters can be recorded by several threads (see `use_profiler`).
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.cpu_started_at = time.process_time()
+        self.stages = []
+        self.counters = defaultdict(int)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, **info):
+        """Times the code in the block. `info` (eg. page counts) can be added to until the block exits"""
+        record = dict(name=name, depth=_depth.get())
+        with self.lock:
+            self.stages.append(record)
+        started_at = time.perf_counter()
+        cpu_started_at = time.process_time()
+        token = _depth.set(record["depth"] + 1)
+        try:
+            yield info
+        finally:
+            _depth.reset(token)
+            record.update(
+                start=round(started_at - self.started_at, 6),
+                wall=round(time.perf_counter() - started_at, 6),
+                cpu=round(time.process_time() - cpu_started_at, 6),
+                peak_rss_mb=get_peak_rss(),
+                **info,
+            )
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def get_report(self):
+        return dict(
+            wall=round(time.perf_counter() - self.started_at, 6),
+            cpu=round(time.process_time() - self.cpu_started_at, 6),
+            peak_rss_mb=get_peak_rss(),
+            counters=dict(self.counters),
+            stages=self.stages,
+        )
+
+    def get_trace_events(self):
+        """The stages as Trace Event Format 'complete' events (for chrome://tracing or Perfetto)"""
+        pid = os.getpid()
+        events = []
+        for record in self.stages:
+            if "wall" not in record:
+                continue
+            args = {
+                key: value
+                for key, value in record.items()
+                if key not in ("name", "depth", "start", "wall")
+            }
+            events.append(
+                dict(
+                    name=record["name"],
+                    ph="X",
+                    ts=round(record["start"] * 1e6),
+                    dur=round(record["wall"] * 1e6),
+                    pid=pid,
+                    tid=0,
+                    args=args,
+                )
+            )
+        return dict(traceEvents=events, displayTimeUnit="ms")
+
+    def write_report(self, file_path):
+        with open(file_path, "w") as f:
+            json.dump(self.get_report(), f, indent=2)
+
+    def write_trace(self, file_path):
+        with open(file_path, "w") as f:
+            json.dump(self.get_trace_events(), f)
+
+
+@contextmanager
+def profile():
+    """Profiles the code in the block (run by the current thread), and yields the Profiler"""
+    previous = getattr(_local, "profiler", None)
+    _local.profiler = Profiler()
+    token = _depth.set(0)
+    try:
+        yield _local.profiler
+    finally:
+        _depth.reset(token)
+        _local.profiler = previous
+
+
+def get_profiler():
+    """The profiler of the current thread, if profiling"""
+    return getattr(_local, "profiler", None)
+
+
+@contextmanager
+def use_profiler(profiler):
+    """Records the stages and counters of the current thread in the block to `profiler` (eg. of another thread)"""
+    previous = getattr(_local, "profiler", None)
+    _local.profiler = profiler
+    try:
+        yield profiler
+    finally:
+        _local.profiler = previous
+
+
+@contextmanager
+def stage(name, **info):
+    """Records the block as a stage, if profiling. Yields a dict, for information about the stage"""
+    profiler = get_profiler()
+    if profiler is None:
+        yield info
+        return
+    with profiler.stage(name, **info) as info:
+        yield info
+
+
+def count(name, value=1):
+    if profiler := get_profiler():
+        profiler.count(name, value)
+
+
+def profiled(name, describe=None):
+    """
+    Decorator recording each call of a method as a stage.
+    describe: called with the object after the call, returns information about the stage
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if get_profiler() is None:
+                return method(self, *args, **kwargs)
+            with stage(name) as info:
+                result = method(self, *args, **kwargs)
+                if describe:
+                    info.update(describe(self))
+                return result
+
+        return wrapper
+
+    return decorator
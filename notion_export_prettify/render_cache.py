@@ -0,0 +1,146 @@
+import hashlib
+import logging
+import os
+import threading
+from importlib.metadata import version
+from os import path
+
+import fitz  # PyMuPDF
+
+from .profiler import count
+
+
+def file_digest(file_path):
+    with open(file_path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def folder_digest(folder):
+    """Digest of the names and contents of all files in a folder (recursively)"""
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = path.join(root, name)
+            digest.update(path.relpath(file_path, folder).encode() + b"\0")
+            digest.update(file_digest(file_path).encode())
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """
+    On-disk cache of rendered PDFs, addressed by a hash of everything they are rendered from.
+
+    context: what all entries depend on (eg. the digest of the template files), in addition to the tool version
+    max_size: size of the cache (in bytes), past which `evict` removes the least recently used entries
+    """
+
+    def __init__(self, cache_dir, max_size=1024**3, context=""):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.context = f"{version('notion-export-prettify')}|{context}"
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def make_key(self, *parts):
+        digest = hashlib.sha256(self.context.encode())
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode()
+            # Length-prefixed, so that parts can't run into each other
+            digest.update(len(part).to_bytes(8, "big") + part)
+        return digest.hexdigest()
+
+    def get_path(self, key, extension=".pdf"):
+        return path.join(self.cache_dir, key[:2], key + extension)
+
+    def get(self, key, extension=".pdf"):
+        """Content of an entry (as bytes), or None if not cached"""
+        file_path = self.get_path(key, extension)
+        try:
+            with open(file_path, "rb") as f:
+                data = f.read()
+            # The modification time is the last use, for the LRU eviction
+            os.utime(file_path)
+        except FileNotFoundError:
+            self.misses += 1
+            count("render_cache_misses")
+            return None
+        self.hits += 1
+        count("render_cache_hits")
+        return data
+
+    def put(self, key, data, extension=".pdf"):
+        file_path = self.get_path(key, extension)
+        os.makedirs(path.dirname(file_path), exist_ok=True)
+        # Written under a temporary name, so that concurrent runs never read partial files
+        temp_path = f"{file_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, file_path)
+
+    def get_pdf(self, key):
+        data = self.get(key)
+        if data is not None:
+            return fitz.open(stream=data, filetype="pdf")
+
+    def put_pdf(self, key, doc):
+        self.put(key, doc.tobytes())
+
+    def evict(self):
+        """Removes the least recently used entries, until the cache fits in `max_size`"""
+        entries = []
+        total_size = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = os.stat(path.join(root, name))
+                except FileNotFoundError:
+                    # Evicted by a concurrent run
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, path.join(root, name)))
+                total_size += stat.st_size
+
+        for _, size, file_path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            logging.debug("Evicting %s from the render cache", file_path)
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+
+class MemoryRenderCache(RenderCache):
+    """
+    Render cache kept in memory, for a long-running process (eg. watch mode).
+    `evict` removes the entries that haven't been used since it was last called.
+    """
+
+    def __init__(self):
+        self.context = ""
+        self.hits = 0
+        self.misses = 0
+        self.entries = {}
+        self.used = set()
+
+    def get(self, key, extension=".pdf"):
+        data = self.entries.get((key, extension))
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.used.add((key, extension))
+        return data
+
+    def put(self, key, data, extension=".pdf"):
+        self.entries[(key, extension)] = data
+        self.used.add((key, extension))
+
+    def evict(self):
+        self.entries = {key: data for key, data in self.entries.items() if key in self.used}
+        self.used.clear()
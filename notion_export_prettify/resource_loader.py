@@ -1,21 +1,167 @@
+import logging
+import os
+import threading
 from os import path
 
+# The text resources that a template can define
+TEMPLATE_FILES = [
+    "page.css",
+    "overwrites.css",
+    "header.html",
+    "background.html",
+    "cover.html",
+]
 
-class ResourceLoader:
-    def __init__(self) -> None:
-        self.dir = None
+# The Jinja templates among them, and the PDF files
+HTML_TEMPLATE_FILES = ["header.html", "background.html", "cover.html"]
+PDF_FILES = ["background.pdf", "cover.pdf"]
 
-    def set_folder(self, dir):
-        self.dir = dir
+# Jinja environment of each cache folder
+_environments = {}
+_environment_lock = threading.Lock()
+_default_lock = threading.Lock()
+
+
+def get_stamp(file_path):
+    """What tells whether a file changed (None if it doesn't exist)"""
+    try:
+        stat = os.stat(file_path)
+        return stat.st_mtime_ns, stat.st_size
+    except FileNotFoundError:
+        return None
+
+
+def get_jinja_environment(cache_dir=None):
+    """
+    The Jinja environment shared by all templates, compiled once per process (and cached on disk as bytecode,
+    in the "templates" folder of `cache_dir`, ~/.cache/notion-export-prettify by default).
+    Templates are named by their absolute path, and recompiled when their file changes
+    """
+    with _environment_lock:
+        if cache_dir not in _environments:
+            from jinja2 import BaseLoader, Environment, FileSystemBytecodeCache, TemplateNotFound
+
+            from .image_optimizer import default_cache_dir
+
+            class FileLoader(BaseLoader):
+                def get_source(self, environment, template):
+                    stamp = get_stamp(template)
+                    if stamp is None:
+                        raise TemplateNotFound(template)
+                    with open(template, "r") as f:
+                        source = f.read()
+                    return source, template, lambda: get_stamp(template) == stamp
+
+            bytecode_cache = None
+            bytecode_dir = path.join(cache_dir or default_cache_dir(), "templates")
+            try:
+                os.makedirs(bytecode_dir, exist_ok=True)
+                # Read-only caches are not used, as Jinja fails when it can't write to them
+                if not os.access(bytecode_dir, os.W_OK):
+                    raise PermissionError(f"{bytecode_dir} is not writable")
+                bytecode_cache = FileSystemBytecodeCache(bytecode_dir)
+            except OSError as e:
+                logging.debug("No bytecode cache for templates: %s", e)
+            _environments[cache_dir] = Environment(
+                loader=FileLoader(), bytecode_cache=bytecode_cache, auto_reload=True
+            )
+        return _environments[cache_dir]
+
+
+class TemplateBundle:
+    """
+    A template folder, loaded once: text resources are read, HTML templates compiled (see `get_jinja_environment`),
+    and background and cover PDFs opened.
+    Entries are reloaded when their file changes, for long-running processes (server, batch workers, watch mode)
+    to load each template once and still see its changes.
+    Can be shared by threads.
+
+    cache_dir: where compiled templates are cached (see `get_jinja_environment`)
+    """
+
+    def __init__(self, dir=None, cache_dir=None):
+        self.dir = path.abspath(dir) if dir else None
+        self.cache_dir = cache_dir
+        # filename -> (stamp, content)
+        self.contents = {}
+        self.lock = threading.Lock()
+
+    def preload(self):
+        for filename in TEMPLATE_FILES:
+            self.get_resource_content(filename)
+        for filename in HTML_TEMPLATE_FILES:
+            self.get_template(filename)
+
+        # PyMuPDF documents can't be shared between threads: they are opened for the current thread,
+        # and by other threads on first use
+        from .pdf_maker import open_background
+
+        for filename in PDF_FILES:
+            if file_path := self.get_resource_path(filename):
+                open_background(file_path)
 
     def get_resource_path(self, filename):
         if self.dir:
             file_path = path.join(self.dir, filename)
-            if path.exists(file_path):
+            if get_stamp(file_path) is not None:
                 return file_path
 
     def get_resource_content(self, filename):
-        file_path = self.get_resource_path(filename)
-        if file_path:
-            with open(file_path, "r") as f:
-                return f.read()
+        if not self.dir:
+            return None
+        file_path = path.join(self.dir, filename)
+        stamp = get_stamp(file_path)
+        with self.lock:
+            cached = self.contents.get(filename)
+            if cached and cached[0] == stamp:
+                return cached[1]
+
+            content = None
+            if stamp is not None:
+                with open(file_path, "r") as f:
+                    content = f.read()
+            self.contents[filename] = (stamp, content)
+            return content
+
+    def get_template(self, filename):
+        """The compiled Jinja template (None if the template folder has no such file)"""
+        if file_path := self.get_resource_path(filename):
+            return get_jinja_environment(self.cache_dir).get_template(file_path)
+
+
+class TemplateCache:
+    """
+    The bundle of each template, only loaded once, to be shared by conversions (and threads).
+    Templates are identified by the path of their config file, as given by `args.parse_args`.
+
+    cache_dir: where compiled templates are cached (see `get_jinja_environment`)
+    """
+
+    # Default cache of each cache folder
+    _defaults = {}
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.resources = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def default(cls, cache_dir=None):
+        """The cache shared by the conversions of this process (using the same cache folder)"""
+        with _default_lock:
+            if cache_dir not in cls._defaults:
+                cls._defaults[cache_dir] = cls(cache_dir)
+            return cls._defaults[cache_dir]
+
+    def get_resources(self, template_file) -> TemplateBundle:
+        template_dir = path.dirname(path.abspath(template_file)) if template_file else None
+        with self.lock:
+            if template_dir not in self.resources:
+                logging.debug("Preloading template in '%s'", template_dir)
+                resources = TemplateBundle(template_dir, self.cache_dir)
+                resources.preload()
+                self.resources[template_dir] = resources
+            return self.resources[template_dir]
+
+    def __len__(self):
+        return len(self.resources)
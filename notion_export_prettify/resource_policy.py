@@ -0,0 +1,207 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import tempfile
+import time
+from os import path
+from urllib.parse import unquote, urlparse
+
+from .asset_server import ORIGIN
+from .browser_session import playwright_error
+from .profiler import count
+
+# Extension of the files holding the content type of mirrored resources, when their name doesn't give it
+CONTENT_TYPE_SUFFIX = ".content-type"
+
+
+def is_remote(url):
+    """Whether the URL is fetched from the network (not a file, data URL, or the in-memory asset server)"""
+    return url.startswith(("http://", "https://")) and not url.startswith(ORIGIN)
+
+
+class ResourcePolicy:
+    """
+    How documents load remote resources (KaTeX stylesheets, embeds, favicons, hosted images...),
+    applied to each browser page through request routing.
+
+    block: only fetch resources of the allowed hosts (and those of the mirror)
+    allowed_hosts: hosts fetched even when blocking, including their subdomains
+    mirror_dir: folder serving remote resources (as <host>/<path>) instead of the network.
+        Resources fetched are saved to it, for the next renders
+    timeout: maximum time of each remote request (in seconds). Defaults to Playwright's
+    wait_until: condition the page waits for before printing
+    slow_after: time after which a remote resource is recorded as slow (in seconds)
+
+    Remote requests are only routed when there is something to enforce (blocking, a mirror or a timeout).
+    Blocked, failed and slow resources are recorded, for `get_report`.
+    """
+
+    def __init__(
+        self,
+        block=False,
+        allowed_hosts=None,
+        mirror_dir=None,
+        timeout=None,
+        wait_until="load",
+        slow_after=2.0,
+    ):
+        self.block = block
+        self.allowed_hosts = [host.lower().lstrip(".") for host in allowed_hosts or []]
+        self.mirror_dir = path.realpath(mirror_dir) if mirror_dir else None
+        self.timeout = timeout
+        self.wait_until = wait_until
+        self.slow_after = slow_after
+
+        self.blocked = []
+        self.failed = []
+        self.slow = []
+        self.mirrored = 0
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(
+            block=args.remote_resources == "block",
+            allowed_hosts=args.allow_host,
+            mirror_dir=args.resource_mirror,
+            timeout=args.resource_timeout,
+            wait_until=args.wait_until,
+        )
+
+    @property
+    def enabled(self):
+        return self.block or bool(self.mirror_dir) or self.timeout is not None
+
+    def attach(self, page):
+        if self.enabled:
+            page.route(is_remote, self.handle)
+
+    async def attach_async(self, page):
+        """Same as `attach`, for pages of Playwright's async API"""
+        if self.enabled:
+            await page.route(is_remote, self.handle_async)
+
+    def handle(self, route):
+        url = route.request.url
+        if (body := self.read_mirror(url)) is not None:
+            return route.fulfill(status=200, body=body, content_type=self.get_content_type(url))
+        if not self.is_allowed(url):
+            return route.abort("blockedbyclient")
+
+        started_at = time.perf_counter()
+        try:
+            response = route.fetch(**self.get_fetch_options())
+        except playwright_error() as e:
+            return route.abort(self.fetch_failed(url, e))
+        self.fetched(url, response.status, response.headers, response.body(), started_at)
+        return route.fulfill(response=response)
+
+    async def handle_async(self, route):
+        """Same as `handle`, for pages of Playwright's async API"""
+        url = route.request.url
+        if (body := self.read_mirror(url)) is not None:
+            return await route.fulfill(
+                status=200, body=body, content_type=self.get_content_type(url)
+            )
+        if not self.is_allowed(url):
+            return await route.abort("blockedbyclient")
+
+        started_at = time.perf_counter()
+        try:
+            response = await route.fetch(**self.get_fetch_options())
+        except playwright_error() as e:
+            return await route.abort(self.fetch_failed(url, e))
+        self.fetched(url, response.status, response.headers, await response.body(), started_at)
+        return await route.fulfill(response=response)
+
+    def get_fetch_options(self):
+        return dict(timeout=self.timeout * 1000) if self.timeout is not None else {}
+
+    def is_allowed(self, url):
+        """Whether the resource can be fetched, recording it as blocked otherwise"""
+        if not self.block:
+            return True
+        host = (urlparse(url).hostname or "").lower()
+        if any(host == allowed or host.endswith("." + allowed) for allowed in self.allowed_hosts):
+            return True
+
+        logging.debug("Blocked remote resource: %s", url)
+        self.blocked.append(url)
+        count("resources_blocked")
+        return False
+
+    def fetch_failed(self, url, error):
+        """Records a failed request, and returns the error code to abort it with"""
+        logging.debug("Remote resource failed: %s (%s)", url, error)
+        self.failed.append(dict(url=url, error=str(error).splitlines()[0]))
+        count("resources_failed")
+        return "timedout" if type(error).__name__ == "TimeoutError" else "failed"
+
+    def fetched(self, url, status, headers, body, started_at):
+        seconds = time.perf_counter() - started_at
+        count("resources_fetched")
+        if seconds >= self.slow_after:
+            logging.debug("Slow remote resource: %s (%.2fs)", url, seconds)
+            self.slow.append(dict(url=url, seconds=round(seconds, 3)))
+        if status == 200:
+            self.write_mirror(url, body, headers.get("content-type"))
+
+    def get_mirror_path(self, url):
+        """Where the resource is in the mirror (None without mirror, or if the URL points outside of it)"""
+        if not self.mirror_dir:
+            return None
+        parsed = urlparse(url)
+        name = unquote(parsed.path).lstrip("/")
+        if not name or name.endswith("/"):
+            name += "index"
+        if parsed.query:
+            name += "_" + hashlib.sha1(parsed.query.encode()).hexdigest()[:12]
+
+        file_path = path.realpath(path.join(self.mirror_dir, parsed.netloc.lower(), name))
+        # Never read or write anything outside of the mirror
+        if not file_path.startswith(self.mirror_dir + path.sep):
+            return None
+        return file_path
+
+    def read_mirror(self, url):
+        file_path = self.get_mirror_path(url)
+        if not file_path or not path.isfile(file_path):
+            return None
+        with open(file_path, "rb") as f:
+            body = f.read()
+        self.mirrored += 1
+        count("resources_mirrored")
+        return body
+
+    def get_content_type(self, url):
+        file_path = self.get_mirror_path(url)
+        if path.isfile(file_path + CONTENT_TYPE_SUFFIX):
+            with open(file_path + CONTENT_TYPE_SUFFIX) as f:
+                return f.read().strip()
+        return mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+
+    def write_mirror(self, url, body, content_type):
+        file_path = self.get_mirror_path(url)
+        if not file_path:
+            return
+        try:
+            os.makedirs(path.dirname(file_path), exist_ok=True)
+            # Written atomically, for concurrent renders to never read part of a file
+            fd, temp_path = tempfile.mkstemp(dir=path.dirname(file_path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(body)
+            os.replace(temp_path, file_path)
+            if content_type and content_type.split(";")[0] != mimetypes.guess_type(file_path)[0]:
+                with open(file_path + CONTENT_TYPE_SUFFIX, "w") as f:
+                    f.write(content_type)
+        except OSError as e:
+            logging.debug("Could not mirror %s: %s", url, e)
+
+    def get_report(self):
+        """The remote resources blocked, failed and slow, and the number of them served from the mirror"""
+        return dict(
+            blocked=sorted(set(self.blocked)),
+            failed=self.failed,
+            slow=self.slow,
+            mirrored=self.mirrored,
+        )
@@ -0,0 +1,370 @@
+import argparse
+import json
+import logging
+import queue
+import shutil
+import socketserver
+import tempfile
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib.metadata import version
+from os import path, remove
+from urllib.parse import parse_qsl, urlparse
+
+from .args import modify_config_path, options_to_argv, parse_args
+from .browser_session import BrowserSession
+from .converter import Converter
+from .print_color import green
+from .resource_loader import TemplateCache
+
+CHUNK_SIZE = 1024 * 1024
+
+# Options reading or writing files of the server, that clients can't set
+# (nor abbreviations of them, which argparse would accept)
+PATH_OPTIONS = [
+    "output",
+    "previews",
+    "resource-mirror",
+    "profile-report",
+    "profile-trace",
+    "cache-dir",
+    "template",
+]
+
+BUILTIN_TEMPLATES_DIR = path.realpath(path.join(path.dirname(__file__), "../templates"))
+
+
+def is_builtin_template(template_file):
+    """Whether the template config file is the one of a built-in template"""
+    template_dir = path.dirname(path.realpath(template_file))
+    return (
+        path.dirname(template_dir) == BUILTIN_TEMPLATES_DIR
+        and path.basename(template_file) == "template.cfg"
+    )
+
+
+def query_to_argv(query, allowed_templates=()):
+    """
+    Turns the query string parameters of a request into command line arguments.
+    Templates are limited to the built-in ones, and to the config files of `allowed_templates`
+    """
+    options = parse_qsl(query)
+    for key, value in options:
+        if key == "template":
+            template_file = path.realpath(modify_config_path(["-t", value])[1])
+            if template_file not in allowed_templates and not is_builtin_template(template_file):
+                raise ValueError(f"Unknown template: {value}")
+        elif key and any(name.startswith(key) for name in PATH_OPTIONS):
+            raise ValueError(f"--{key} cannot be set remotely")
+    return options_to_argv(options)
+
+
+class Job:
+    """
+    A conversion, with the temporary folder of its input and output files.
+    The folder is shared by the request handler and the worker converting the job, and removed once both released
+    it: a worker still converting a job that timed out writes to it, and removes it when done.
+    """
+
+    def __init__(self):
+        self.dir = tempfile.mkdtemp(prefix="notion-export-prettify-")
+        self.input_file = path.join(self.dir, "export.zip")
+        self.output_file = path.join(self.dir, "output.pdf")
+        self.args = None
+        self.error = None
+        self.done = threading.Event()
+        # Set when the client stopped waiting for the job
+        self.cancelled = False
+        self.queued_at = None
+        # Request handler and worker using the folder
+        self.owners = 1
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            self.owners += 1
+
+    def release(self):
+        """Releases the folder, which is removed by the last owner"""
+        with self.lock:
+            self.owners -= 1
+            if self.owners:
+                return
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+class RenderService:
+    """
+    A bounded queue of conversion jobs, consumed by a fixed number of workers.
+    Each worker keeps its own warm browser, and templates are only read once.
+    """
+
+    def __init__(self, workers=1, queue_size=16, templates=()):
+        self.workers = workers
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.sessions = []
+
+        self.templates = TemplateCache()
+        # Config files of the templates given at startup, which clients can use besides the built-in ones
+        self.allowed_templates = set()
+        for template in templates:
+            template_file = modify_config_path(["-t", template])[1]
+            self.templates.get_resources(template_file)
+            self.allowed_templates.add(path.realpath(template_file))
+
+        self.metrics_lock = threading.Lock()
+        self.started_at = time.time()
+        self.busy_workers = 0
+        self.counters = dict(
+            jobs_accepted=0,
+            jobs_rejected=0,
+            jobs_succeeded=0,
+            jobs_failed=0,
+            jobs_timed_out=0,
+            queue_seconds=0.0,
+            render_seconds=0.0,
+        )
+
+    def start(self):
+        for i in range(self.workers):
+            threading.Thread(
+                target=self._work, name=f"render-worker-{i}", daemon=True
+            ).start()
+
+    def submit(self, job: Job):
+        job.queued_at = time.monotonic()
+        # The worker owns the job's folder as soon as it can get the job
+        job.acquire()
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            job.release()
+            self._count("jobs_rejected")
+            raise
+        self._count("jobs_accepted")
+
+    def timed_out(self, job: Job):
+        """The client stopped waiting for the job: it's skipped if not started yet"""
+        job.cancelled = True
+        self._count("jobs_timed_out")
+
+    def _work(self):
+        # Playwright's sync API is bound to a thread, so each worker has its own browser
+        session = BrowserSession()
+        session.start()
+        self.sessions.append(session)
+
+        while True:
+            job = self.jobs.get()
+            if job.cancelled:
+                job.release()
+                continue
+            started_at = time.monotonic()
+            self._count("queue_seconds", started_at - job.queued_at)
+            self._busy(1)
+            try:
+                Converter(
+                    job.args,
+                    session=session,
+                    resources=self.templates.get_resources(job.args.template),
+                ).run(output_file=job.output_file)
+                self._count("jobs_succeeded")
+            except Exception as e:
+                logging.exception("Conversion failed")
+                job.error = e
+                self._count("jobs_failed")
+            finally:
+                self._count("render_seconds", time.monotonic() - started_at)
+                self._busy(-1)
+                job.done.set()
+                job.release()
+
+    def _count(self, name, value=1):
+        with self.metrics_lock:
+            self.counters[name] += value
+
+    def _busy(self, value):
+        with self.metrics_lock:
+            self.busy_workers += value
+
+    def get_health(self):
+        browsers_up = sum(
+            1 for s in self.sessions if s.browser and s.browser.is_connected()
+        )
+        return dict(
+            status="ok" if browsers_up == self.workers else "degraded",
+            workers=self.workers,
+            browsers_up=browsers_up,
+        )
+
+    def get_metrics(self):
+        with self.metrics_lock:
+            return dict(
+                self.counters,
+                uptime_seconds=time.time() - self.started_at,
+                workers=self.workers,
+                busy_workers=self.busy_workers,
+                queued_jobs=self.jobs.qsize(),
+                queue_size=self.jobs.maxsize,
+                browser_launches=sum(s.launches for s in self.sessions),
+                templates_loaded=len(self.templates),
+            )
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    server_version = f"notion-export-prettify/{version('notion-export-prettify')}"
+
+    def do_GET(self):
+        route = urlparse(self.path).path
+        if route == "/health":
+            self.send_json(self.server.service.get_health())
+        elif route == "/metrics":
+            self.send_json(self.server.service.get_metrics())
+        else:
+            self.send_error(HTTPStatus.NOT_FOUND)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/convert":
+            return self.send_error(HTTPStatus.NOT_FOUND)
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return self.send_error(HTTPStatus.BAD_REQUEST, "Missing zip file")
+        if length > self.server.max_upload_size:
+            return self.send_error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+
+        job = Job()
+        try:
+            with open(job.input_file, "wb") as f:
+                remaining = length
+                while remaining:
+                    chunk = self.rfile.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        return self.send_error(HTTPStatus.BAD_REQUEST, "Truncated upload")
+                    f.write(chunk)
+                    remaining -= len(chunk)
+
+            try:
+                argv = query_to_argv(url.query, self.server.service.allowed_templates)
+                job.args = parse_args([job.input_file] + argv)
+            except (SystemExit, ValueError) as e:
+                return self.send_error(HTTPStatus.BAD_REQUEST, f"Invalid options: {e}")
+
+            try:
+                self.server.service.submit(job)
+            except queue.Full:
+                return self.send_error(HTTPStatus.SERVICE_UNAVAILABLE, "Queue is full")
+            if not job.done.wait(self.server.job_timeout):
+                self.server.service.timed_out(job)
+                return self.send_error(HTTPStatus.GATEWAY_TIMEOUT, "Conversion timed out")
+
+            if isinstance(job.error, ValueError):
+                return self.send_error(HTTPStatus.UNPROCESSABLE_ENTITY, str(job.error))
+            if job.error:
+                return self.send_error(HTTPStatus.INTERNAL_SERVER_ERROR, str(job.error))
+
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", "application/pdf")
+            self.send_header("Content-Length", str(path.getsize(job.output_file)))
+            self.end_headers()
+            with open(job.output_file, "rb") as f:
+                shutil.copyfileobj(f, self.wfile, CHUNK_SIZE)
+        finally:
+            job.release()
+
+    def send_json(self, content):
+        body = json.dumps(content).encode()
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix sockets have no client address
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        return "unix"
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def parse_serve_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="notion-export-prettify serve",
+        description="Keep a warm renderer running, and convert Notion exports over HTTP. "
+        "POST the zip file to /convert, with options and metadata as query parameters "
+        "(eg. /convert?template=example&title=My%20title&cover-page=false).",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument(
+        "--unix-socket",
+        type=str,
+        default=None,
+        help="Path of a Unix socket to listen on, instead of a TCP port",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=2, help="Number of concurrent renders"
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=16,
+        help="Number of jobs that can wait for a worker before requests get rejected",
+    )
+    parser.add_argument(
+        "-t",
+        "--template",
+        action="append",
+        default=[],
+        help="Template to preload, which clients can use besides the built-in ones. Can be repeated",
+    )
+    parser.add_argument(
+        "--job-timeout",
+        type=float,
+        default=300,
+        help="Maximum time to wait for a conversion (queue included), in seconds",
+    )
+    parser.add_argument(
+        "--max-upload-size",
+        type=int,
+        default=1024,
+        help="Maximum size of an uploaded export, in MB",
+    )
+    return parser.parse_args(argv)
+
+
+def serve(argv):
+    args = parse_serve_args(argv)
+
+    service = RenderService(
+        workers=args.workers, queue_size=args.queue_size, templates=args.template
+    )
+    service.start()
+
+    if args.unix_socket:
+        if path.exists(args.unix_socket):
+            remove(args.unix_socket)
+        server = UnixHTTPServer(args.unix_socket, RequestHandler)
+        address = f"unix:{args.unix_socket}"
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), RequestHandler)
+        address = f"http://{args.host}:{args.port}"
+
+    server.service = service
+    server.max_upload_size = args.max_upload_size * 1024 * 1024
+    server.job_timeout = args.job_timeout
+
+    green(f"Listening on {address} with {args.workers} worker(s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
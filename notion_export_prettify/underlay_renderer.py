@@ -0,0 +1,70 @@
+import logging
+
+from bs4 import BeautifulSoup
+
+PAGE_NUMBER_PLACEHOLDER = "__PAGENUMBER__"
+
+# Each page of the underlay gets its own box, sized to the matching page of the main document.
+# The box becomes the containing block for the absolutely positioned header and footer,
+# which is what the page itself was when each underlay was rendered as a separate document.
+underlay_page_css = """
+@page {
+    margin: 0;
+}
+html, body {
+    margin: 0 !important;
+    padding: 0 !important;
+}
+.underlay-page {
+    position: relative;
+    overflow: hidden;
+    break-after: page;
+}
+.underlay-page:last-child {
+    break-after: auto;
+}
+"""
+
+
+class UnderlayRenderer:
+    """Renders the underlay of every page as a single multi-page HTML document"""
+
+    def __init__(self, underlay_html):
+        self.soup = BeautifulSoup(underlay_html, "html.parser")
+        if not self.soup.body:
+            raise Exception("Underlay template has no <body>")
+
+        # The content of the body is repeated for each page
+        self.page_template = self.soup.body.decode_contents()
+
+    def get_html(self, page_sizes, page_numbers=None):
+        """
+        page_sizes: list of (width, height) tuples, in points, one per page of the main document
+        page_numbers: number of each of those pages. Defaults to 1, 2, 3...
+        """
+        if page_numbers is None:
+            page_numbers = range(1, len(page_sizes) + 1)
+
+        soup = BeautifulSoup(str(self.soup), "html.parser")
+
+        new_style_tag = soup.new_tag("style", type="text/css")
+        new_style_tag.string = underlay_page_css
+        if soup.head:
+            soup.head.append(new_style_tag)
+        else:
+            soup.body.insert_before(new_style_tag)
+
+        pages = []
+        for page_number, (width, height) in zip(page_numbers, page_sizes):
+            logging.debug("Making underlay for page %s", page_number - 1)
+            page_html = self.page_template.replace(
+                PAGE_NUMBER_PLACEHOLDER, str(page_number)
+            )
+            pages.append(
+                f'<div class="underlay-page" style="width: {width}pt; height: {height}pt;">'
+                f"{page_html}</div>"
+            )
+
+        soup.body.clear()
+        soup.body.append(BeautifulSoup("".join(pages), "html.parser"))
+        return str(soup)
@@ -0,0 +1,155 @@
+import logging
+import os
+import shutil
+import tempfile
+import time
+from os import path
+
+import fitz  # PyMuPDF
+
+from .args import parse_args
+from .browser_session import BrowserSession
+from .converter import Converter
+from .pdf_maker import PdfMaker
+from .print_color import green, orange, red
+from .render_cache import MemoryRenderCache
+from .resource_loader import get_stamp
+
+
+class Watcher:
+    """
+    Regenerates the PDF whenever the input file or the template change, only redoing the stages affected:
+    - the export is only extracted and parsed again when it changes, or when options changing its manipulations do
+    - metadata and CSS are updated in the document manipulated by the previous run
+    - the main document, cover and underlays are only rendered again when their HTML changes
+    """
+
+    def __init__(self, argv, session: BrowserSession, interval=0.5):
+        self.argv = list(argv)
+        self.session = session
+        self.interval = interval
+        self.cache = MemoryRenderCache()
+        self.temp_dir = tempfile.mkdtemp()
+
+        # Extracted export: (stamp of the input file, HTML file, assets)
+        self.export = None
+        # Manipulated document: (structure key, manipulator, assets)
+        self.document = None
+        # Main document rendered from the manipulated HTML: (HTML, in memory, PDF bytes)
+        self.main_render = None
+
+    def get_watched_files(self, args):
+        files = [path.abspath(args.input_file)]
+        if args.template:
+            template_dir = path.dirname(path.abspath(args.template))
+            files += [
+                path.join(template_dir, name)
+                for name in sorted(os.listdir(template_dir))
+                if path.isfile(path.join(template_dir, name))
+            ]
+        return files
+
+    def watch(self):
+        files = self.get_watched_files(parse_args(list(self.argv)))
+        green(f"[WATCH] Watching {len(files)} files. Press Ctrl+C to stop")
+        stamps = None
+        try:
+            while True:
+                new_stamps = [get_stamp(file_path) for file_path in files]
+                if new_stamps != stamps:
+                    stamps = new_stamps
+                    self.build()
+                time.sleep(self.interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def build(self):
+        started_at = time.perf_counter()
+        try:
+            args = parse_args(list(self.argv))
+        except SystemExit:
+            # Invalid template config: wait for the next change
+            red("[ERROR] Invalid arguments or template config")
+            return
+
+        # Resources are extracted once, and kept for the next runs
+        args.lazy_assets = False
+        try:
+            converter = Converter(args, session=self.session, cache=self.cache)
+            pdf_maker, manipulator = self.render_main(converter)
+
+            converter.add_underlay(pdf_maker)
+            converter.add_background(pdf_maker)
+            converter.add_cover_page(pdf_maker)
+            green("[PROC] Building PDF TOC")
+            pdf_maker.make_toc(manipulator.get_heading_map())
+            converter.add_metadata(pdf_maker)
+            converter.save(pdf_maker)
+        except Exception as e:
+            logging.debug("Build failed", exc_info=True)
+            red(f"[ERROR] {e}")
+            return
+        green(f"[WATCH] PDF regenerated in {time.perf_counter() - started_at:.2f}s")
+
+    def render_main(self, converter: Converter):
+        args = converter.args
+
+        input_stamp = get_stamp(args.input_file)
+        if not self.export or self.export[0] != input_stamp:
+            green("[PROC] Extracting input")
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+            os.makedirs(self.temp_dir)
+            html_file = converter.extract_input(self.temp_dir)
+            self.export = (input_stamp, html_file, converter.assets)
+            # Its resources may have changed too, even if the HTML hasn't
+            self.document = None
+            self.main_render = None
+        else:
+            orange("[SKIP] Input unchanged")
+        _, html_file, converter.assets = self.export
+
+        # What the manipulations of the document depend on (besides metadata and CSS)
+        structure_key = (
+            args.strip_internal_info,
+            args.heading_numbers,
+            args.table_of_contents,
+            args.html_parser,
+            args.optimize_images,
+            args.image_dpi,
+            args.image_print_width,
+            args.in_memory,
+            converter.with_cover_page,
+            bool(converter.resources.get_resource_path("header.html")),
+        )
+        if self.document and self.document[0] == structure_key:
+            orange("[SKIP] Document already parsed and manipulated. Updating metadata and CSS")
+            _, manipulator, converter.assets = self.document
+            converter.update_html(manipulator)
+        else:
+            manipulator = converter.manipulate_html(html_file)
+            if args.optimize_images:
+                green("[PROC] Optimising images")
+                converter.optimize_images(manipulator, self.temp_dir)
+            self.document = (structure_key, manipulator, converter.assets)
+
+        html = manipulator.get_html()
+        if self.main_render and self.main_render[:2] == (html, args.in_memory):
+            orange("[SKIP] Main document unchanged")
+            pdf_maker = PdfMaker(
+                temp_dir=self.temp_dir,
+                session=self.session,
+                in_memory=args.in_memory,
+                cache=self.cache,
+                resource_policy=converter.resource_policy,
+            )
+            pdf_maker.pdf_doc = fitz.open(stream=self.main_render[2], filetype="pdf")
+        else:
+            pdf_maker = converter.render_document(manipulator, self.temp_dir)
+            self.main_render = (html, args.in_memory, pdf_maker.pdf_doc.tobytes())
+        return pdf_maker, manipulator
+
+
+def watch(argv, session: BrowserSession):
+    Watcher(argv, session).watch()
@@ -0,0 +1,257 @@
+import copy
+import logging
+import os
+import tempfile
+import time
+import zipfile
+from os import listdir, path
+
+import fitz  # PyMuPDF
+
+from .batch import run_conversions
+from .browser_session import BrowserSession
+from .converter import Converter
+from .exceptions import InvalidExportError
+from .pdf_maker import PdfMaker
+from .print_color import green, orange, red
+
+# Links to other pages are rendered as links to this URL in each page,
+# and turned into internal links once the pages are merged
+PAGE_LINK_PREFIX = "https://notion-export-prettify.invalid/page/"
+
+
+class WorkspacePage:
+    def __init__(self, html_path, depth, parent=None):
+        self.path = html_path
+        self.depth = depth
+        self.parent = parent
+        self.index = None
+
+
+def find_pages(root_dir):
+    """
+    Finds all pages of an export, in document order: each page is followed by its sub-pages.
+    Notion stores the sub-pages (and assets) of `Page.html` in the `Page` folder next to it.
+    """
+    pages = []
+
+    def walk(folder, depth, parent):
+        names = sorted(listdir(folder))
+        for name in names:
+            if name.endswith(".html"):
+                page = WorkspacePage(path.join(folder, name), depth, parent)
+                page.index = len(pages)
+                pages.append(page)
+
+                sub_folder = page.path[: -len(".html")]
+                if path.isdir(sub_folder):
+                    walk(sub_folder, depth + 1, page)
+
+        # Folders that don't belong to a page (eg. the top folder of the export)
+        for name in names:
+            sub_folder = path.join(folder, name)
+            if path.isdir(sub_folder) and not path.exists(sub_folder + ".html"):
+                walk(sub_folder, depth, parent)
+
+    walk(path.abspath(root_dir), 0, None)
+    return pages
+
+
+def extract_workspace(input_file, temp_dir):
+    """Extracts the export (including the nested zip files of large exports), and returns its folder"""
+    if path.isdir(input_file):
+        return input_file
+
+    if not input_file.endswith(".zip"):
+        raise InvalidExportError("Workspace exports must be a zip file or a folder")
+
+    with zipfile.ZipFile(input_file, "r") as zip_ref:
+        zip_ref.extractall(temp_dir)
+
+    for name in listdir(temp_dir):
+        if name.endswith(".zip"):
+            nested_zip = path.join(temp_dir, name)
+            with zipfile.ZipFile(nested_zip, "r") as zip_ref:
+                zip_ref.extractall(temp_dir)
+            os.remove(nested_zip)
+
+    return temp_dir
+
+
+def get_page_args(args, page: WorkspacePage, output_file=None):
+    page_args = copy.copy(args)
+    page_args.input_file = page.path
+    page_args.output = output_file
+    if page.index > 0:
+        # Sub-pages use their own title and description, and never get a cover page
+        page_args.title = None
+        page_args.description = None
+        page_args.cover_page = False
+    return page_args
+
+
+def _render_page_to_merge(args, link_map, output_file):
+    """
+    Renders one page to merge, without header, footers and cover (which are added to the merged document).
+    Standalone pages (without --merge) are converted as any document instead, see `convert_pages`
+    """
+    started_at = time.monotonic()
+    result = dict(input=args.input_file, output=output_file)
+    try:
+        converter = Converter(args, link_map=link_map)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            pdf_maker, manipulator = converter.render_main(temp_dir)
+            pdf_maker.make_toc(manipulator.get_heading_map())
+            # Pages to merge are only intermediate files: the merged document is saved with args.save_profile
+            pdf_maker.save(output_file, "fast")
+            result["toc"] = pdf_maker.pdf_doc.get_toc()
+        result["metadata"] = converter.metadata
+        result["status"] = "ok"
+    except Exception as e:
+        logging.exception("Rendering of %s failed", args.input_file)
+        result["status"] = "failed"
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.monotonic() - started_at, 3)
+    return result
+
+
+def convert_pages(args, pages, root_dir):
+    """Converts each page into its own PDF (saved with args.save_profile), and returns the results"""
+    output_dir = args.output or path.dirname(path.abspath(args.input_file))
+
+    output_files = [
+        path.join(output_dir, path.relpath(page.path, root_dir)[: -len(".html")] + ".pdf")
+        for page in pages
+    ]
+    for output_file in output_files:
+        os.makedirs(path.dirname(output_file), exist_ok=True)
+
+    conversions = []
+    for page, output_file in zip(pages, output_files):
+        # Links to other pages point to their PDF files instead
+        link_map = {
+            other.path: path.relpath(other_output_file, path.dirname(output_file))
+            for other, other_output_file in zip(pages, output_files)
+        }
+        conversions.append(
+            (get_page_args(args, page, output_file), dict(link_map=link_map))
+        )
+
+    return run_conversions(conversions, jobs=args.jobs)
+
+
+def merge_pages(args, pages, temp_dir):
+    """Converts all pages, and merges them into a single PDF following the page hierarchy"""
+    link_map = {page.path: f"{PAGE_LINK_PREFIX}{page.index}" for page in pages}
+    conversions = [
+        (
+            get_page_args(args, page),
+            link_map,
+            path.join(temp_dir, f"page_{page.index}.pdf"),
+        )
+        for page in pages
+    ]
+    results = run_conversions(conversions, jobs=args.jobs, convert=_render_page_to_merge)
+    results = {r["input"]: r for r in results}
+
+    failed = [r for r in results.values() if r["status"] != "ok"]
+    if failed:
+        return list(results.values())
+
+    # Concatenate all pages, and nest their outlines under an entry for the page itself
+    merged = fitz.open()
+    start_pages = {}
+    toc = []
+    for page in pages:
+        result = results[page.path]
+        start_pages[page.index] = len(merged)
+
+        toc.append([page.depth + 1, result["metadata"]["title"], len(merged) + 1])
+        for level, title, page_number in result["toc"]:
+            toc.append([level + page.depth + 1, title, page_number + len(merged)])
+
+        with fitz.open(result["output"]) as page_doc:
+            merged.insert_pdf(page_doc)
+
+    link_pages(merged, start_pages)
+
+    # Header, footers, background and cover are added to the merged document
+    with BrowserSession() as session:
+        converter = Converter(args, session=session)
+        converter.metadata = results[pages[0].path]["metadata"]
+
+        pdf_maker = PdfMaker(
+            temp_dir=temp_dir,
+            session=session,
+            in_memory=args.in_memory,
+            cache=converter.cache,
+            resource_policy=converter.resource_policy,
+        )
+        pdf_maker.pdf_doc = merged
+        converter.add_underlay(pdf_maker)
+        converter.add_background(pdf_maker)
+        page_count = len(merged)
+        converter.add_cover_page(pdf_maker)
+
+        green("[PROC] Building PDF TOC")
+        offset = len(pdf_maker.pdf_doc) - page_count
+        pdf_maker.pdf_doc.set_toc(fix_toc_levels(toc, offset))
+
+        converter.add_metadata(pdf_maker)
+        output_file = converter.save(pdf_maker)
+
+    return [dict(input=args.input_file, output=output_file, status="ok")]
+
+
+def link_pages(doc, start_pages):
+    """Turns the links to other pages into internal links to their first page"""
+    for page in doc:
+        for link in page.get_links():
+            uri = link.get("uri") or ""
+            if link["kind"] != fitz.LINK_URI or not uri.startswith(PAGE_LINK_PREFIX):
+                continue
+
+            page.delete_link(link)
+            target = start_pages.get(int(uri[len(PAGE_LINK_PREFIX) :]))
+            if target is not None:
+                page.insert_link(
+                    {
+                        "kind": fitz.LINK_GOTO,
+                        "from": link["from"],
+                        "page": target,
+                        "to": fitz.Point(0, 0),
+                    }
+                )
+
+
+def fix_toc_levels(toc, offset=0):
+    """Makes sure that levels never increase by more than one, as required for PDF outlines"""
+    fixed_toc = []
+    last_level = 0
+    for level, title, page_number in toc:
+        level = min(level, last_level + 1)
+        fixed_toc.append([level, title, page_number + offset])
+        last_level = level
+    return fixed_toc
+
+
+def convert_workspace(args):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root_dir = extract_workspace(args.input_file, path.join(temp_dir, "export"))
+        pages = find_pages(root_dir)
+        if not pages:
+            raise InvalidExportError("No HTML page found in the export")
+        green(f"[PROC] Found {len(pages)} page(s) in the export")
+
+        if args.merge:
+            results = merge_pages(args, pages, temp_dir)
+        else:
+            if args.output and path.splitext(args.output)[1]:
+                orange("[SKIP] --output must be a folder with --workspace. Ignoring it")
+                args.output = None
+            results = convert_pages(args, pages, root_dir)
+
+    failed = [r for r in results if r["status"] != "ok"]
+    if failed:
+        red(f"[ERROR] {len(failed)} page(s) failed to convert")
+        exit(1)
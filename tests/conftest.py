@@ -0,0 +1,22 @@
+import sys
+import zipfile
+from os import path
+
+import pytest
+
+# The export generator and the benchmark scripts are shared with the tests
+BENCHMARKS_DIR = path.join(path.dirname(__file__), "..", "benchmarks")
+sys.path.insert(0, path.abspath(BENCHMARKS_DIR))
+
+
+@pytest.fixture(scope="session")
+def export_dir(tmp_path_factory):
+    """A generated export (with sub-pages), extracted"""
+    from generate_export import ExportGenerator
+
+    temp_dir = tmp_path_factory.mktemp("export")
+    export = temp_dir / "export.zip"
+    ExportGenerator(headings=20, paragraphs=80, callouts=6, images=2, pages=3).generate(export)
+    with zipfile.ZipFile(export) as zip_file:
+        zip_file.extractall(temp_dir / "extracted")
+    return temp_dir / "extracted"
@@ -0,0 +1,18 @@
+import pytest
+from parsers import REFERENCE_PARSER, manipulate
+
+from notion_export_prettify.html_parser import available_parsers
+
+OTHER_PARSERS = [parser for parser in available_parsers() if parser != REFERENCE_PARSER]
+
+
+@pytest.mark.skipif(not OTHER_PARSERS, reason="Only html.parser is installed")
+@pytest.mark.parametrize("parser", OTHER_PARSERS)
+def test_parsers_produce_the_same_html(export_dir, parser):
+    html_files = sorted(export_dir.rglob("*.html"))
+    assert html_files
+    for html_file in html_files:
+        html, heading_map = manipulate(str(html_file), parser)
+        reference_html, reference_heading_map = manipulate(str(html_file), REFERENCE_PARSER)
+        assert html == reference_html, f"{parser} differs from {REFERENCE_PARSER} on {html_file.name}"
+        assert heading_map == reference_heading_map
@@ -0,0 +1,27 @@
+import subprocess
+import sys
+
+import pytest
+from import_time import COMMANDS, HEAVY_MODULES
+
+# Runs the CLI with the arguments given, and prints the heavy modules imported by then
+CHECK = f"""
+import sys
+from notion_export_prettify import main
+
+try:
+    main.main()
+except SystemExit:
+    pass
+heavy = sorted({{name.split(".")[0] for name in sys.modules}} & set({HEAVY_MODULES!r}))
+print("HEAVY_MODULES:", *heavy)
+"""
+
+
+@pytest.mark.parametrize("command", COMMANDS, ids=" ".join)
+def test_commands_converting_nothing_import_no_heavy_module(command):
+    result = subprocess.run(
+        [sys.executable, "-c", CHECK, *command], capture_output=True, text=True, check=True
+    )
+    heavy = result.stdout.strip().splitlines()[-1].split()[1:]
+    assert heavy == [], f"{' '.join(command)} imports {', '.join(heavy)}"